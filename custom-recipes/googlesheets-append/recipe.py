@@ -1,13 +1,13 @@
 # -*- coding: utf-8 -*-
-import datetime
 import dataiku
 from dataiku.customrecipe import get_input_names_for_role, get_output_names_for_role, get_recipe_config
 from googlesheets import GoogleSheetsSession
-from gspread.utils import rowcol_to_a1
+from googlesheets_uploader import WorksheetUploader
+from googlesheets_checkpoint import CheckpointStore
+from googlesheets_serialization import iter_dataset_dataframes
+from googlesheets_cache import get_hash
 from safe_logger import SafeLogger
-from googlesheets_common import DSSConstants, extract_credentials, get_tab_ids
-from time import sleep
-from googlesheets_append import append_rows
+from googlesheets_common import DSSConstants, extract_credentials, get_tab_ids, get_upsert_keys, get_number_of_workers
 
 
 logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
@@ -39,61 +39,67 @@ if not tabs_ids:
 tab_id = tabs_ids[0]
 insert_format = config.get("insert_format")
 write_mode = config.get("write_mode", "append")
-session = GoogleSheetsSession(credentials, credentials_type)
-
 batch_size = config.get("batch_size", 200)
+adaptive_batch_size = config.get("adaptive_batch_size", True)
 insertion_delay = config.get("insertion_delay", 0)
+upload_workers = get_number_of_workers(config, "upload_workers", DSSConstants.DEFAULT_UPLOAD_WORKERS)
+requests_per_minute = config.get("requests_per_minute") or DSSConstants.API_REQUESTS_PER_MINUTE
+resume_failed_runs = config.get("resume_failed_runs", False)
+session = GoogleSheetsSession(credentials, credentials_type, requests_per_minute=requests_per_minute)
 
 # Load worksheet
 worksheet = session.get_spreadsheet(doc_id, tab_id)
 
-worksheet.append_rows = append_rows.__get__(worksheet, worksheet.__class__)
-
-
-# Handle datetimes serialization
-def serializer_iso(obj):
-    if isinstance(obj, datetime.datetime):
-        return obj.isoformat()
-    return obj
-
-
-def serializer_dss(obj):
-    if isinstance(obj, datetime.datetime):
-        return obj.strftime(DSSConstants.GSPREAD_DATE_FORMAT)
-    return obj
-
-
-if insert_format == "USER_ENTERED":
-    serializer = serializer_dss
-else:
-    serializer = serializer_iso
 
 # Open writer
 writer = output_dataset.get_writer()
 
 
-# Iteration row by row
-batch = []
-if write_mode == "overwrite":
-    worksheet.clear()
-    columns = [column["name"] for column in input_schema]
-    batch.append(columns)
-for row in input_dataset.iter_rows():
-
-    # write to spreadsheet by batch
-    batch.append([serializer(v) for k, v in list(row.items())])
-
-    if len(batch) >= batch_size:
-        if insertion_delay > 0:
-            sleep(0.01 * insertion_delay)
-        worksheet.append_rows(batch, insert_format)
-        batch = []
+def iter_input_dataframes():
+    return iter_dataset_dataframes(input_dataset)
+
+
+# Checkpoint
+# The rows written without gap are recorded as batches are acknowledged, so that a failed run
+# is resumed after them instead of appending all the rows again.
+# Checkpoints are specific to the partitions being built, and are only used if the first rows
+# of the input are still the ones written by the failed run
+checkpoints = CheckpointStore()
+partitions = sorted(
+    (name, value) for name, value in dataiku.dku_flow_variables.items() if name.startswith("DKU_SRC_") or name.startswith("DKU_DST_")
+)
+checkpoint_key = get_hash(doc_id, tab_id, input_name, partitions, write_mode, insert_format, [column["name"] for column in input_schema])
+if not resume_failed_runs:
+    checkpoints.delete(checkpoint_key)
+uploader = WorksheetUploader(
+    session,
+    worksheet,
+    insert_format,
+    [column["name"] for column in input_schema],
+    write_mode=write_mode,
+    upsert_keys=get_upsert_keys(config),
+    batch_size=batch_size,
+    adaptive_batch_size=adaptive_batch_size,
+    number_of_workers=upload_workers,
+    insertion_delay=insertion_delay,
+    checkpoints=checkpoints if resume_failed_runs else None,
+    checkpoint_key=checkpoint_key,
+    iter_input=iter_input_dataframes
+)
+
+
+# Iteration by chunks of rows
+# Batches are uploaded to explicit row ranges by a small thread pool, so that reading the input
+# and writing the output dataset go on while batches are in flight
+for dataframe in iter_input_dataframes():
+    uploader.write_dataframe(dataframe)
 
     # write to output dataset
-    writer.write_row_dict(row)
+    writer.write_dataframe(dataframe)
 
-if len(batch) > 0:
-    worksheet.append_rows(batch, insert_format)
+uploader.close()
 
 # Close writer
 writer.close()
+
+session.log_metrics("Append recipe", config.get("metrics_file"))
@@ -1,50 +1,106 @@
 from dataiku.connector import Connector, CustomDatasetWriter
-import json
-from collections import OrderedDict
-from gspread.utils import rowcol_to_a1
+import itertools
 from slugify import slugify
 from googlesheets import GoogleSheetsSession
 from safe_logger import SafeLogger
-from googlesheets_common import DSSConstants, extract_credentials, get_tab_ids, mark_date_columns, convert_dates_in_row
+from googlesheets_common import DSSConstants, extract_credentials, get_tab_ids, get_upsert_keys, mark_date_columns, convert_dates_in_rows, UniqueNamesAllocator
+from googlesheets_common import get_partition_tab_title, get_tab_partition_id, get_read_last_row, pad_row, get_number_of_workers
 from googlesheets_append import append_rows
+from googlesheets_cache import get_hash
+from googlesheets_snapshot import SnapshotStore
+from googlesheets_rows import iter_header_records, iter_no_header_records, iter_json_records, peek_rows_width
+from googlesheets_schema import infer_schema, merge_column_types, get_dss_types, serial_number_to_date
+from googlesheets_writer import WorksheetRangesWriter, estimate_row_bytes
+from googlesheets_upsert import WorksheetUpsertWriter
 
 
 logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
 
 
+def slugify_column_name(name):
+    return slugify(name, max_length=25, separator="_", lowercase=False)
+
+
 class MyConnector(Connector):
 
     def __init__(self, config):
         Connector.__init__(self, config)  # pass the parameters to the base class
         logger.info("GoogleSheets connector v{} starting with {}".format(DSSConstants.PLUGIN_VERSION, logger.filter_secrets(config)))
         credentials, credentials_type = extract_credentials(config)
-        self.session = GoogleSheetsSession(credentials, credentials_type)
+        requests_per_minute = self.config.get("requests_per_minute") or DSSConstants.API_REQUESTS_PER_MINUTE
+        self.session = GoogleSheetsSession(credentials, credentials_type, requests_per_minute=requests_per_minute)
         self.doc_id = self.config.get("doc_id")
         self.tabs_ids = get_tab_ids(config)
         self.result_format = self.config.get("result_format")
         self.write_format = self.config.get("write_format")
-        self.lines_to_skip = self.config.get("lines_to_skip")
-        self.list_unique_slugs = []
+        self.lines_to_skip = self.config.get("lines_to_skip") or 0
+        self.read_window_size = self.config.get("read_window_size", DSSConstants.DEFAULT_READ_WINDOW_SIZE)
+        self.columns_slugs_allocator = UniqueNamesAllocator(normalize=slugify_column_name)
         self.add_sheet_name_column = self.config.get("add_sheet_name_column", False)
+        self.use_snapshots = self.config.get("use_snapshots", False)
+        self.typed_values = self.config.get("typed_values", False) and self.result_format == 'first-row-header'
+        self.value_render_option = "UNFORMATTED_VALUE" if self.typed_values else "FORMATTED_VALUE"
+        self.snapshots = SnapshotStore()
+        self.metrics_file = self.config.get("metrics_file")
+        self.upload_workers = get_number_of_workers(self.config, "upload_workers", DSSConstants.DEFAULT_UPLOAD_WORKERS)
+        self.upsert_keys = get_upsert_keys(self.config)
+        self.partitioned_by_tab = self.config.get("partitioned_by_tab", False)
+        self.partition_tabs_pattern = self.config.get("partition_tabs_pattern") or DSSConstants.PARTITION_PLACEHOLDER
+        if self.partitioned_by_tab and self.partition_tabs_pattern.count(DSSConstants.PARTITION_PLACEHOLDER) != 1:
+            raise ValueError("The sheets names pattern should contain {} exactly once".format(DSSConstants.PARTITION_PLACEHOLDER))
 
     def get_unique_slug(self, string):
-        string = slugify(string, max_length=25, separator="_", lowercase=False)
-        if string == '':
-            string = 'none'
-        test_string = string
-        i = 0
-        while test_string in self.list_unique_slugs:
-            i += 1
-            test_string = string + '_' + str(i)
-        self.list_unique_slugs.append(test_string)
-        return test_string
+        return self.columns_slugs_allocator.allocate(string)
+
+    def get_columns_slugs(self, first_row, number_of_columns=0):
+        # Data columns with a blank header, trimmed from the header row by the API, are named like empty headers
+        columns = ["{}".format(column) for column in pad_row(first_row, number_of_columns)]
+        if self.add_sheet_name_column and self.result_format == 'first-row-header':
+            columns.insert(0, "Sheet name")
+        self.columns_slugs_allocator = UniqueNamesAllocator(normalize=slugify_column_name)
+        return list(map(self.get_unique_slug, columns))
 
     def get_read_schema(self):
         # The Google Spreadsheets connector does not have a fixed schema, since each
         # sheet has its own (varying) schema.
         #
-        # Better let DSS handle this
-        return None
+        # Better let DSS handle this, unless typed values are requested
+        if not self.typed_values:
+            return None
+        worksheets = self.get_selected_worksheets()
+        header_row = self.lines_to_skip + 1
+        last_row = header_row + DSSConstants.SCHEMA_INFERENCE_SAMPLE_ROWS
+        columns_number_formats = self.session.get_columns_number_formats(worksheets, header_row + 1, last_row)
+        worksheets_rows = self.session.iter_worksheets_rows(
+            worksheets,
+            first_row=header_row,
+            last_row=last_row,
+            window_size=self.read_window_size,
+            value_render_option=self.value_render_option
+        )
+        schema_columns = None
+        for worksheet, rows in worksheets_rows:
+            first_row = next(rows, None)
+            if first_row is None:
+                continue
+            rows = list(rows)
+            columns_slugs = self.get_columns_slugs(first_row, max([len(row) for row in rows] or [0]))
+            data_columns_slugs = columns_slugs[1:] if self.add_sheet_name_column else columns_slugs
+            worksheet_schema_columns = infer_schema(data_columns_slugs, rows, columns_number_formats.get(worksheet.title))
+            if self.add_sheet_name_column:
+                worksheet_schema_columns.insert(0, {"name": columns_slugs[0], "type": "string"})
+            if schema_columns is None:
+                schema_columns = worksheet_schema_columns
+            elif [column["name"] for column in schema_columns] != columns_slugs:
+                logger.info("Sheets have different columns, letting DSS infer the schema")
+                return None
+            else:
+                for column, worksheet_column in zip(schema_columns, worksheet_schema_columns):
+                    column["type"] = merge_column_types(column["type"], worksheet_column["type"])
+        if schema_columns is None:
+            return None
+        logger.info("Inferred schema: {}".format(schema_columns))
+        return {"columns": schema_columns}
 
     def generate_rows(self, dataset_schema=None, dataset_partitioning=None,
                       partition_id=None, records_limit=-1):
@@ -56,44 +112,94 @@ class MyConnector(Connector):
 
         The dataset schema and partitioning are given for information purpose.
         """
+        version = None
+        snapshot_key = None
+        tabs_ids = self.get_tabs_ids(partition_id)
+        if self.use_snapshots:
+            version = self.session.get_document_version(self.doc_id)
+            snapshot_key = self.get_snapshot_key(tabs_ids)
+        if self.use_snapshots and self.snapshots.get_meta(snapshot_key, version):
+            logger.info("Document {} has not changed since the last read, using the local snapshot".format(self.doc_id))
+            worksheets_rows = self.snapshots.iter_worksheets_rows(snapshot_key)
+        else:
+            worksheets_rows = self.fetch_worksheets_rows(records_limit, tabs_ids)
+            if self.use_snapshots and not (records_limit is not None and records_limit > 0):
+                worksheets_rows = self.snapshots.record(snapshot_key, version, worksheets_rows)
+
+        dss_types = get_dss_types(dataset_schema) if self.typed_values else {}
+        records_count = 0
+        try:
+            for worksheet_title, rows in worksheets_rows:
+                for row in self.generate_worksheet_rows(worksheet_title, rows, dss_types):
+                    yield row
+                    records_count += 1
+                    if records_limit is not None and 0 < records_limit <= records_count:
+                        return
+        finally:
+            self.session.log_metrics("Connector read of {} records".format(records_count), self.metrics_file)
+
+    def get_snapshot_key(self, tabs_ids):
+        return get_hash(self.session.client.client_key, self.doc_id, tabs_ids, self.lines_to_skip, self.value_render_option)
+
+    def get_tabs_ids(self, partition_id=None):
+        # In partitioned mode, each partition is stored in its own tab
+        if self.partitioned_by_tab and partition_id:
+            return [get_partition_tab_title(self.partition_tabs_pattern, partition_id)]
+        return self.tabs_ids
+
+    def get_selected_worksheets(self, tabs_ids=None):
+        tabs_ids = self.tabs_ids if tabs_ids is None else tabs_ids
         worksheets = self.session.get_spreadsheets(self.doc_id)
-
-        for worksheet in worksheets:
-            if self.tabs_ids and (worksheet.title not in self.tabs_ids):
-                continue
-            rows = worksheet.get_all_values()[self.lines_to_skip:]
-            try:
-                columns = rows[0]
-            except IndexError:
-                columns = []
-
-            if self.add_sheet_name_column and self.result_format == 'first-row-header':
-                columns.insert(0, "Sheet name")
-
-            self.list_unique_slugs = []
-            columns_slug = list(map(self.get_unique_slug, columns))
-
-            if self.result_format == 'first-row-header':
-                for row in rows[1:]:
-                    if self.add_sheet_name_column:
-                        row.insert(0, "{}".format(worksheet.title))
-                    yield OrderedDict(zip(columns_slug, row))
-
-            elif self.result_format == 'no-header':
-                for row in rows:
-                    if self.add_sheet_name_column:
-                        row.insert(0, "{}".format(worksheet.title))
-                    yield OrderedDict(zip(range(1, len(columns) + 1), row))
-
-            elif self.result_format == 'json':
-                for row in rows:
-                    if self.add_sheet_name_column:
-                        row.insert(0, "{}".format(worksheet.title))
-                    yield {"json": json.dumps(row)}
-
-            else:
-
-                raise Exception("Unimplemented")
+        return [worksheet for worksheet in worksheets if not tabs_ids or worksheet.title in tabs_ids]
+
+    def fetch_worksheets_rows(self, records_limit=-1, tabs_ids=None):
+        selected_worksheets = self.get_selected_worksheets(tabs_ids)
+        last_row = get_read_last_row(self.lines_to_skip, self.result_format, records_limit)
+        worksheets_rows = self.session.iter_worksheets_rows(
+            selected_worksheets,
+            first_row=self.lines_to_skip + 1,
+            last_row=last_row,
+            window_size=self.read_window_size,
+            value_render_option=self.value_render_option
+        )
+        for worksheet, rows in worksheets_rows:
+            yield worksheet.title, rows
+
+    def generate_worksheet_rows(self, worksheet_title, rows, dss_types=None):
+        first_row = next(rows, None)
+        if first_row is None:
+            return
+        if self.result_format != 'first-row-header':
+            rows = itertools.chain([first_row], rows)
+        # All rows are padded to the width of the first window, as they come with their trailing empty cells trimmed
+        number_of_columns, rows = peek_rows_width(rows, self.read_window_size)
+        number_of_columns = max(number_of_columns, len(first_row))
+
+        columns_slug = self.get_columns_slugs(first_row, number_of_columns)
+        sheet_name = "{}".format(worksheet_title) if self.add_sheet_name_column else None
+
+        if self.result_format == 'first-row-header':
+            sheet_key = None
+            if self.add_sheet_name_column:
+                sheet_key, columns_slug = columns_slug[0], columns_slug[1:]
+            # Typed values come with dates as serial numbers
+            converters = {
+                column_slug: serial_number_to_date for column_slug in columns_slug if (dss_types or {}).get(column_slug) == "date"
+            }
+            for record in iter_header_records(rows, columns_slug, sheet_key, sheet_name, converters, get_extra_key=lambda: self.get_unique_slug("")):
+                yield record
+
+        elif self.result_format == 'no-header':
+            for record in iter_no_header_records(rows, sheet_name, number_of_columns):
+                yield record
+
+        elif self.result_format == 'json':
+            for record in iter_json_records(rows, sheet_name, number_of_columns):
+                yield record
+
+        else:
+
+            raise Exception("Unimplemented")
 
     def get_writer(self, dataset_schema=None, dataset_partitioning=None,
                    partition_id=None, write_mode="OVERWRITE"):
@@ -101,21 +207,61 @@ class MyConnector(Connector):
         if self.result_format == 'json':
             raise Exception('JSON format not supported in write mode')
 
-        if not self.tabs_ids:
+        if self.partitioned_by_tab:
+            if not partition_id:
+                raise Exception('A partition should be selected for writing to a dataset partitioned by sheet')
+        elif not self.tabs_ids:
             raise Exception('The name of the target sheet should be set')
 
-        if len(self.tabs_ids) > 1:
+        elif len(self.tabs_ids) > 1:
             raise Exception('Only one target sheet can be selected for writing')
 
         return MyCustomDatasetWriter(self.config, self, dataset_schema, dataset_partitioning, partition_id, write_mode)
 
+    def get_partitioning(self):
+        """
+        Returns the partitioning of the dataset: one partition per sheet whose name matches the pattern
+        """
+        if not self.partitioned_by_tab:
+            return Connector.get_partitioning(self)
+        return {"dimensions": [{"name": DSSConstants.PARTITION_DIMENSION, "type": "value"}]}
+
+    def list_partitions(self, partitioning):
+        """
+        Returns the partitions found in the names of the sheets, from the document metadata only
+        """
+        if not self.partitioned_by_tab:
+            return []
+        partitions_ids = []
+        for worksheet in self.session.get_spreadsheets(self.doc_id):
+            partition_id = get_tab_partition_id(self.partition_tabs_pattern, worksheet.title)
+            if partition_id is not None:
+                partitions_ids.append(partition_id)
+        return partitions_ids
+
+    def partition_exists(self, partitioning, partition_id):
+        return partition_id in self.list_partitions(partitioning)
+
     def get_records_count(self, partitioning=None, partition_id=None):
         """
         Returns the count of records for the dataset (or a partition).
         """
-        # row_count currently rounds up to 1000 records
-        # For this reason, canCountRecords is set to false and this method is currently ignored by DSS
-        raise NotImplementedError("Count records")
+        # row_count is the size of the grid, usually rounded up to 1000 rows, so the last non empty
+        # rows are looked for instead, or taken from the local snapshot when the document has not changed
+        tabs_ids = self.get_tabs_ids(partition_id)
+        header_rows = 1 if self.result_format == 'first-row-header' else 0
+        if self.use_snapshots:
+            meta = self.snapshots.get_meta(self.get_snapshot_key(tabs_ids), self.session.get_document_version(self.doc_id))
+            if meta:
+                # Snapshots hold the rows read after the skipped lines, header included
+                records_count = sum(max(sheet["rows"] - header_rows, 0) for sheet in meta.get("sheets", {}).values())
+                logger.info("Document {} has not changed since the last read, {} records counted from the local snapshot".format(self.doc_id, records_count))
+                return records_count
+        worksheets = self.get_selected_worksheets(tabs_ids)
+        last_rows = self.session.get_last_rows(worksheets)
+        records_count = sum(max(last_row - self.lines_to_skip - header_rows, 0) for last_row in last_rows.values())
+        self.session.log_metrics("Connector count of {} records".format(records_count), self.metrics_file)
+        return records_count
 
 
 class MyCustomDatasetWriter(CustomDatasetWriter):
@@ -126,38 +272,92 @@ class MyCustomDatasetWriter(CustomDatasetWriter):
         self.dataset_schema = dataset_schema
         self.dataset_partitioning = dataset_partitioning
         self.partition_id = partition_id
+        self.tab_id = parent.get_tabs_ids(partition_id)[0]
         self.write_mode = write_mode
         self.buffer = []
+        self.buffer_bytes = 0
+        self.header_row = None
+        self.worksheet = None
+        self.ranges_writer = None
+        self.upsert_writer = None
+        self.written_rows = 0
         self.date_columns = []
         if self.parent.write_format == "USER_ENTERED":
             self.date_columns = mark_date_columns(dataset_schema)
             logger.info("Columns #{} are marked for date conversion".format(self.date_columns))
         columns = [column["name"] for column in dataset_schema["columns"]]
-        if parent.result_format == 'first-row-header':
-            self.buffer.append(columns)
+        self.num_columns = max(len(columns), 1)
+        # Rows are sent as soon as a request worth of cells or bytes is buffered, so memory stays flat
+        # and requests stay well below Google's payload size limit
+        self.rows_per_request = max(DSSConstants.MAX_CELLS_PER_WRITE_REQUEST // self.num_columns, 1)
+        if self.parent.upsert_keys and self.write_mode == "OVERWRITE":
+            if parent.result_format != 'first-row-header':
+                raise Exception('Upsert key columns can only be used with the first row header format')
+            self.upsert_writer = WorksheetUpsertWriter(
+                self.parent.session, self.get_worksheet(), columns, self.parent.upsert_keys, self.parent.write_format
+            )
+        elif parent.result_format == 'first-row-header' and self.write_mode == "OVERWRITE":
+            self.header_row = columns
+            self.buffer_bytes = estimate_row_bytes(columns)
 
     def write_row(self, row):
-        if self.date_columns:
-            row = convert_dates_in_row(row, self.date_columns)
         self.buffer.append(row)
+        self.buffer_bytes += estimate_row_bytes(row)
+        if len(self.buffer) >= self.rows_per_request or self.buffer_bytes >= DSSConstants.MAX_BYTES_PER_WRITE_REQUEST:
+            self.flush()
+
+    def get_worksheet(self):
+        if self.worksheet is None:
+            if self.parent.partitioned_by_tab:
+                # Sheets of new partitions are created on their first write
+                self.worksheet = self.parent.session.get_or_add_spreadsheet(self.parent.doc_id, self.tab_id, columns=self.num_columns)
+            else:
+                self.worksheet = self.parent.session.get_spreadsheet(self.parent.doc_id, self.tab_id)
+            self.worksheet.append_rows = append_rows.__get__(self.worksheet, self.worksheet.__class__)
+        return self.worksheet
+
+    def get_ranges_writer(self):
+        # Chunks are written concurrently to explicit ranges, and the sheet is truncated to the written rows on close
+        if self.ranges_writer is None:
+            self.ranges_writer = WorksheetRangesWriter(
+                self.get_worksheet(),
+                self.parent.write_format,
+                first_row=1,
+                number_of_workers=self.parent.upload_workers,
+                truncate=True
+            )
+        return self.ranges_writer
 
     def flush(self):
-        worksheet = self.parent.session.get_spreadsheet(self.parent.doc_id, self.parent.tabs_ids[0])
-        worksheet.append_rows = append_rows.__get__(worksheet, worksheet.__class__)
-
-        if self.write_mode == "APPEND":
-            worksheet.append_rows(self.buffer[1:], self.parent.write_format) #TODO: batch ?
-        elif self.write_mode == "OVERWRITE":
-            num_columns = len(self.buffer[0])
-            num_lines = len(self.buffer)
-
-            worksheet.resize(rows=num_lines, cols=num_columns)
-
-            range = 'A1:%s' % rowcol_to_a1(num_lines, num_columns)
-            worksheet.update(range, self.buffer, value_input_option=self.parent.write_format)
-
+        rows = self.buffer
+        if self.date_columns:
+            # Dates of the whole chunk are converted at once, right before sending it
+            rows = convert_dates_in_rows(rows, self.date_columns)
+        if self.header_row is not None and self.written_rows == 0:
+            rows = [self.header_row] + rows
         self.buffer = []
+        self.buffer_bytes = 0
+        if not rows:
+            return
+
+        if self.upsert_writer is not None:
+            # Rows are only compared to the sheet here, changes are sent on close
+            self.upsert_writer.write_rows(rows)
+        elif self.write_mode == "APPEND":
+            self.get_worksheet().append_rows(rows, self.parent.write_format)
+        elif self.write_mode == "OVERWRITE":
+            self.get_ranges_writer().write_rows(rows)
+        self.written_rows += len(rows)
 
     def close(self):
         self.flush()
-        pass
+        if self.upsert_writer is not None:
+            self.upsert_writer.close()
+        elif self.write_mode == "OVERWRITE":
+            if self.ranges_writer is not None:
+                self.ranges_writer.close()
+            else:
+                worksheet = self.get_worksheet()
+                worksheet.clear()
+                worksheet.resize(rows=1, cols=self.num_columns)
+        self.parent.session.log_metrics("Connector write", self.parent.metrics_file)
@@ -1,13 +1,25 @@
 import json
 import os.path
+import itertools
 import gspread
+from gspread.utils import rowcol_to_a1, a1_to_rowcol
 from oauth2client.service_account import ServiceAccountCredentials
 from oauth2client.client import AccessTokenCredentials
 from safe_logger import SafeLogger
+from googlesheets_common import DSSConstants
+from googlesheets_client import authorize, SPREADSHEETS_API_V4_BASE_URL
+from googlesheets_cache import TTLCache, get_hash
+from googlesheets_schema import get_columns_number_formats
+from googlesheets_metrics import APIMetrics
 
 
 logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
 
+SPREADSHEET_VALUES_BATCH_GET_URL = SPREADSHEETS_API_V4_BASE_URL + "/%s/values:batchGet"
+DRIVE_FILE_URL = "https://www.googleapis.com/drive/v3/files/%s"
+
+authorized_clients = TTLCache()
+
 
 def _get_service_account_credentials(input_credentials):
     """
@@ -33,67 +45,266 @@ def _get_service_account_credentials(input_credentials):
 
 class GoogleSheetsSession():
     scope = [
-        'https://www.googleapis.com/auth/spreadsheets'
+        'https://www.googleapis.com/auth/spreadsheets',
+        'https://www.googleapis.com/auth/drive.metadata.readonly'
     ]
 
-    def __init__(self, credentials, credentials_type="preset-service-account"):
+    def __init__(self, credentials, credentials_type="preset-service-account", requests_per_minute=DSSConstants.API_REQUESTS_PER_MINUTE):
         self.client = None
+        self.metrics = APIMetrics()
+        # Authorized clients are shared by all the sessions of the process using the same credentials
+        client_key = get_hash(credentials_type, credentials, requests_per_minute)
+        authorized_client = authorized_clients.get(client_key)
+        if authorized_client:
+            client, self.email = authorized_client
+            self.client = client.get_session_client(self.metrics)
+            return
         if credentials_type == "service-account":
             credentials = _get_service_account_credentials(credentials)
-            self.client = gspread.authorize(
+            self.client = authorize(
                 ServiceAccountCredentials.from_json_keyfile_dict(
                     credentials,
                     self.scope
-                )
+                ),
+                requests_per_minute=requests_per_minute,
+                client_key=client_key
             )
             self.email = credentials.get("client_email", "(email missing)")
         else:
-            self.client = gspread.authorize(
-                AccessTokenCredentials(credentials, "dss-googledrive-plugin/2.0")
+            self.client = authorize(
+                AccessTokenCredentials(credentials, "dss-googledrive-plugin/2.0"),
+                requests_per_minute=requests_per_minute,
+                client_key=client_key
             )
             self.email = "(email missing)"
+        authorized_clients.set(client_key, (self.client, self.email))
+        self.client = self.client.get_session_client(self.metrics)
+
+    def log_metrics(self, label, metrics_file=None):
+        """
+        Logs a summary of the API calls made since the session was created or the metrics last logged,
+        and optionally saves it as JSON to metrics_file.
+        """
+        return self.metrics.log_summary(logger, label, metrics_file)
 
     def get_spreadsheet(self, document_id, tab_id):
         return self.get_spreadsheets(document_id, tab_id)[0]
 
     def get_spreadsheets(self, document_id, tab_id=None):
         try:
-            # worksheet and worksheets both make a single fetch_sheet_metadata request
-            # so better use one worksheets than multiple worksheet
+            # open_by_key, worksheet and worksheets share the client's cached spreadsheet metadata
             if tab_id:
                 return [self.client.open_by_key(document_id).worksheet(tab_id)]
             else:
                 return self.client.open_by_key(document_id).worksheets()
-        except gspread.exceptions.SpreadsheetNotFound as error:
-            logger.error("{}".format(error))
-            raise Exception("Trying to open non-existent or inaccessible spreadsheet document.")
-        except gspread.exceptions.WorksheetNotFound as error:
-            logger.error("{}".format(error))
-            raise Exception("Trying to open non-existent sheet. Verify that the sheet name exists (%s)." % tab_id)
-        except gspread.exceptions.APIError as error:
-            if hasattr(error, 'response'):
-                error_json = error.response.json()
-                logger.error(error_json)
-                error_status = error_json.get("error", {}).get("status")
-                if error_status == 'PERMISSION_DENIED':
-                    error_message = error_json.get("error", {}).get("message", "")
-                    raise Exception("Access was denied with the following error: %s. Have you enabled the Sheets API? Have you shared the spreadsheet with %s?" % (error_message, self.email))
-                if error_status == 'NOT_FOUND':
-                    raise Exception("Trying to open non-existent spreadsheet document. Verify the document id exists (%s)." % document_id)
-                if error_status == 'FAILED_PRECONDITION':
-                    raise Exception("This document is not a Google Sheet. Please use the Google Drive plugin instead.")
-            raise Exception("The Google API returned an error: %s" % error)
+        except Exception as error:
+            self.raise_api_error(error, document_id, tab_id)
+
+    def get_or_add_spreadsheet(self, document_id, tab_id, rows=1, columns=1):
+        for worksheet in self.get_spreadsheets(document_id):
+            if worksheet.title == tab_id:
+                return worksheet
+        logger.info("Adding sheet '{}' to document {}".format(tab_id, document_id))
+        try:
+            spreadsheet = self.client.open_by_key(document_id)
+            response = spreadsheet.batch_update({
+                "requests": [{
+                    "addSheet": {
+                        "properties": {
+                            "title": tab_id,
+                            "sheetType": "GRID",
+                            "gridProperties": {"rowCount": rows, "columnCount": columns}
+                        }
+                    }
+                }]
+            }, is_idempotent=False)
+            return gspread.models.Worksheet(spreadsheet, response["replies"][0]["addSheet"]["properties"])
+        except Exception as error:
+            self.raise_api_error(error, document_id, tab_id)
 
     def get_spreadsheet_title(self, document_id):
         try:
             return self.client.open_by_key(document_id).title
-        except gspread.exceptions.SpreadsheetNotFound as error:
+        except Exception as error:
+            self.raise_api_error(error, document_id, document_id)
+
+    def get_document_version(self, document_id):
+        """
+        Returns the Drive version of the document, which increases on every change, or None if it
+        cannot be read (Drive API not enabled, or credentials without the Drive metadata scope).
+        """
+        try:
+            response = self.client.request(
+                'get',
+                DRIVE_FILE_URL % document_id,
+                params={"fields": "version,modifiedTime", "supportsAllDrives": "true"}
+            ).json()
+        except Exception as error:
+            logger.warning("Could not get the version of document {}: {}".format(document_id, error))
+            return None
+        logger.info("Document {} version {} last modified on {}".format(document_id, response.get("version"), response.get("modifiedTime")))
+        return response.get("version")
+
+    def iter_worksheets_rows(self, worksheets, first_row=1, last_row=None, window_size=DSSConstants.DEFAULT_READ_WINDOW_SIZE,
+                             value_render_option="FORMATTED_VALUE"):
+        """
+        Yields a (worksheet, rows) tuple for each worksheet, rows being an iterator over the
+        worksheet's rows from first_row to last_row (1-based, included).
+        With value_render_option UNFORMATTED_VALUE, values are typed and dates are serial numbers.
+        Worksheets are cut in windows of window_size rows, and windows of all the worksheets are
+        fetched together with values:batchGet, so that small tabs cost a single request and
+        only one batch is held in memory at a time.
+        Empty rows in the middle of a sheet are yielded as [], trailing empty rows are dropped.
+        The rows of a worksheet should be consumed before moving to the next worksheet.
+        """
+        read_plan = []
+        for worksheet in worksheets:
+            read_plan.append((worksheet, get_read_windows(worksheet, first_row, last_row, window_size)))
+        fetched_windows = self.iter_fetched_windows(
+            ((worksheet, window) for worksheet, windows in read_plan for window in windows),
+            value_render_option=value_render_option
+        )
+        for worksheet, windows in read_plan:
+            rows = iter_windows_rows(itertools.islice(fetched_windows, len(windows)))
+            yield worksheet, rows
+            # Leftovers have to be consumed so that the next worksheet starts on its own windows
+            for _ in rows:
+                pass
+
+    def iter_worksheet_rows(self, worksheet, first_row=1, last_row=None, window_size=DSSConstants.DEFAULT_READ_WINDOW_SIZE,
+                            value_render_option="FORMATTED_VALUE"):
+        for _, rows in self.iter_worksheets_rows([worksheet], first_row, last_row, window_size, value_render_option):
+            for row in rows:
+                yield row
+
+    def iter_fetched_windows(self, windows, max_cells=DSSConstants.MAX_CELLS_PER_READ_REQUEST, value_render_option="FORMATTED_VALUE"):
+        """
+        Takes an iterator of (worksheet, (first_row, last_row)) windows and yields
+        (first_row, last_row, values) for each of them, grouping consecutive windows of a same
+        spreadsheet in values:batchGet requests of at most max_cells grid cells.
+        """
+        batch = []
+        batch_cells = 0
+        for worksheet, window in windows:
+            window_cells = (window[1] - window[0] + 1) * worksheet.col_count
+            if batch and (
+                batch_cells + window_cells > max_cells
+                or len(batch) >= DSSConstants.MAX_RANGES_PER_READ_REQUEST
+                or batch[0][0].spreadsheet.id != worksheet.spreadsheet.id
+            ):
+                for fetched_window in self.batch_get_windows(batch, value_render_option):
+                    yield fetched_window
+                batch = []
+                batch_cells = 0
+            batch.append((worksheet, window))
+            batch_cells += window_cells
+        if batch:
+            for fetched_window in self.batch_get_windows(batch, value_render_option):
+                yield fetched_window
+
+    def batch_get_windows(self, windows, value_render_option="FORMATTED_VALUE"):
+        spreadsheet = windows[0][0].spreadsheet
+        ranges = [
+            get_a1_range(worksheet.title, window[0], window[1], worksheet.col_count) for worksheet, window in windows
+        ]
+        values_of_ranges = self.batch_get_ranges(
+            spreadsheet, ranges, [worksheet.title for worksheet, _ in windows], value_render_option
+        )
+        for (worksheet, window), values in zip(windows, values_of_ranges):
+            yield window[0], window[1], values
+
+    def batch_get_ranges(self, spreadsheet, ranges, tabs_ids, value_render_option="FORMATTED_VALUE"):
+        """
+        Returns the values of each A1 range, trailing empty rows and cells excluded, in a single values:batchGet request.
+        """
+        params = {
+            "ranges": ranges,
+            "majorDimension": "ROWS",
+            "valueRenderOption": value_render_option,
+            "dateTimeRenderOption": "SERIAL_NUMBER"
+        }
+        try:
+            response = spreadsheet.client.request(
+                'get',
+                SPREADSHEET_VALUES_BATCH_GET_URL % spreadsheet.id,
+                params=params
+            ).json()
+        except Exception as error:
+            self.raise_api_error(error, spreadsheet.id, ", ".join(sorted(set(tabs_ids))))
+        values_of_ranges = [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
+        spreadsheet.client.record_cells('get', SPREADSHEET_VALUES_BATCH_GET_URL % spreadsheet.id, sum(
+            len(row) for values in values_of_ranges for row in values
+        ))
+        return values_of_ranges
+
+    def get_last_rows(self, worksheets):
+        """
+        Returns {worksheet title: number of the last non empty row, 0 if the worksheet is empty}.
+        The first column of each worksheet is read, then only the rows below its last value, which
+        are usually all empty and cost nothing to download, so that the worksheets are not read in full.
+        """
+        last_rows = {}
+        for start in range(0, len(worksheets), DSSConstants.MAX_RANGES_PER_READ_REQUEST):
+            batch = worksheets[start:start + DSSConstants.MAX_RANGES_PER_READ_REQUEST]
+            spreadsheet = batch[0].spreadsheet
+            tabs_ids = [worksheet.title for worksheet in batch]
+            first_columns = self.batch_get_ranges(
+                spreadsheet, [get_a1_range(worksheet.title, 1, worksheet.row_count, 1) for worksheet in batch], tabs_ids
+            )
+            for worksheet, values in zip(batch, first_columns):
+                last_rows[worksheet.title] = len(values)
+            remaining_worksheets = [
+                worksheet for worksheet in batch if last_rows[worksheet.title] < worksheet.row_count and worksheet.col_count > 1
+            ]
+            if not remaining_worksheets:
+                continue
+            remaining_rows = self.batch_get_ranges(spreadsheet, [
+                get_a1_range(worksheet.title, last_rows[worksheet.title] + 1, worksheet.row_count, worksheet.col_count)
+                for worksheet in remaining_worksheets
+            ], tabs_ids)
+            for worksheet, values in zip(remaining_worksheets, remaining_rows):
+                last_rows[worksheet.title] += len(values)
+        return last_rows
+
+    def get_columns_number_formats(self, worksheets, first_row, last_row):
+        """
+        Returns {worksheet title: [set of number format types of each column]} for the
+        rows first_row to last_row of the worksheets, in a single request.
+        """
+        if not worksheets:
+            return {}
+        spreadsheet = worksheets[0].spreadsheet
+        ranges = []
+        for worksheet in worksheets:
+            worksheet_last_row = min(last_row, worksheet.row_count)
+            if first_row <= worksheet_last_row:
+                ranges.append(get_a1_range(worksheet.title, first_row, worksheet_last_row, worksheet.col_count))
+        if not ranges:
+            return {}
+        params = {
+            "ranges": ranges,
+            "fields": "sheets(properties(title),data(rowData(values(effectiveFormat(numberFormat(type))))))"
+        }
+        try:
+            response = spreadsheet.fetch_sheet_metadata(params)
+        except Exception as error:
+            self.raise_api_error(error, spreadsheet.id)
+        columns_number_formats = {}
+        for sheet in response.get("sheets", []):
+            grid_data = []
+            for data in sheet.get("data", []):
+                grid_data.extend(data.get("rowData", []))
+            columns_number_formats[sheet.get("properties", {}).get("title")] = get_columns_number_formats(grid_data)
+        return columns_number_formats
+
+    def raise_api_error(self, error, document_id, tab_id=None):
+        if isinstance(error, gspread.exceptions.SpreadsheetNotFound):
             logger.error("{}".format(error))
             raise Exception("Trying to open non-existent or inaccessible spreadsheet document.")
-        except gspread.exceptions.WorksheetNotFound as error:
+        if isinstance(error, gspread.exceptions.WorksheetNotFound):
             logger.error("{}".format(error))
-            raise Exception("Trying to open non-existent sheet. Verify that the sheet name exists (%s)." % document_id)
-        except gspread.exceptions.APIError as error:
+            raise Exception("Trying to open non-existent sheet. Verify that the sheet name exists (%s)." % tab_id)
+        if isinstance(error, gspread.exceptions.APIError):
             if hasattr(error, 'response'):
                 error_json = error.response.json()
                 logger.error(error_json)
@@ -106,3 +317,46 @@ class GoogleSheetsSession():
                 if error_status == 'FAILED_PRECONDITION':
                     raise Exception("This document is not a Google Sheet. Please use the Google Drive plugin instead.")
             raise Exception("The Google API returned an error: %s" % error)
+        raise error
+
+
+def get_read_windows(worksheet, first_row=1, last_row=None, window_size=None):
+    if last_row is None or last_row > worksheet.row_count:
+        last_row = worksheet.row_count
+    if not window_size or window_size < 0:
+        window_size = max(last_row - first_row + 1, 1)
+    windows = []
+    window_first_row = first_row
+    while window_first_row <= last_row:
+        window_last_row = min(window_first_row + window_size - 1, last_row)
+        windows.append((window_first_row, window_last_row))
+        window_first_row = window_last_row + 1
+    return windows
+
+
+def iter_windows_rows(fetched_windows):
+    pending_empty_rows = 0
+    for window_first_row, window_last_row, rows in fetched_windows:
+        for row in rows:
+            if not row:
+                pending_empty_rows += 1
+                continue
+            for _ in range(pending_empty_rows):
+                yield []
+            pending_empty_rows = 0
+            yield row
+        pending_empty_rows += window_last_row - window_first_row + 1 - len(rows)
+
+
+def get_last_row_of_range(a1_range):
+    # 'Sheet 1'!A5:D204 -> 204
+    cells = a1_range.split("!")[-1].split(":")
+    return a1_to_rowcol(cells[-1])[0]
+
+
+def get_a1_range(worksheet_title, first_row, last_row, last_column):
+    return "'{}'!A{}:{}".format(
+        worksheet_title.replace("'", "''"),
+        first_row,
+        rowcol_to_a1(last_row, last_column)
+    )
@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+
+class TTLCache(object):
+    """
+    Thread safe in-memory cache, whose entries expire ttl seconds after being set.
+    A ttl of None keeps the entries for the life of the process.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expiry, value = entry
+            if expiry is not None and expiry < time.monotonic():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expiry, value)
+
+    def invalidate(self, match=None):
+        with self.lock:
+            if match is None:
+                self.entries = {}
+                return
+            for key in [key for key in self.entries if match(key)]:
+                del self.entries[key]
+
+
+def get_hash(*items):
+    hasher = hashlib.sha256()
+    for item in items:
+        hasher.update("{}".format(item).encode("utf-8"))
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+class FileCache(object):
+    """
+    JSON cache persisted in the temporary directory, for values that should survive the
+    short lived processes in which DSS runs the parameters choices, backed by an in-memory TTLCache.
+    """
+
+    def __init__(self, name, ttl):
+        self.ttl = ttl
+        self.memory_cache = TTLCache(ttl=ttl)
+        self.folder = os.path.join(tempfile.gettempdir(), "dss-plugin-googlesheets", name)
+
+    def get_path(self, key):
+        return os.path.join(self.folder, "{}.json".format(key))
+
+    def get(self, key):
+        value = self.memory_cache.get(key)
+        if value is not None:
+            return value
+        try:
+            with open(self.get_path(key), "r") as cache_file:
+                entry = json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get("timestamp", 0) + self.ttl < time.time():
+            return None
+        value = entry.get("value")
+        self.memory_cache.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory_cache.set(key, value)
+        try:
+            os.makedirs(self.folder, mode=0o700, exist_ok=True)
+            temporary_path = "{}.{}.tmp".format(self.get_path(key), os.getpid())
+            file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(file_descriptor, "w") as cache_file:
+                json.dump({"timestamp": time.time(), "value": value}, cache_file)
+            os.replace(temporary_path, self.get_path(key))
+        except (IOError, OSError) as error:
+            logger.warning("Could not write cache file: {}".format(error))
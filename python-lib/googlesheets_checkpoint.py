@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import time
+from googlesheets_common import DSSConstants
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+
+class CheckpointStore(object):
+    """
+    Local JSON checkpoints of the rows already written by a run, so that a failed run can be
+    resumed instead of starting over. Each checkpoint holds the sheet row of the first input row,
+    the number of input rows written up to now without gap, and a hash of these rows.
+    Checkpoints are replaced atomically, are deleted once the run is complete, and expire after ttl seconds.
+    """
+
+    def __init__(self, folder=None, ttl=DSSConstants.CHECKPOINT_TTL):
+        self.folder = folder or os.path.join(tempfile.gettempdir(), "dss-plugin-googlesheets", "checkpoints")
+        self.ttl = ttl
+
+    def get_path(self, key):
+        return os.path.join(self.folder, "{}.json".format(key))
+
+    def load(self, key):
+        path = self.get_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                logger.info("Checkpoint {} has expired".format(key))
+                self.delete(key)
+                return None
+            with open(path, "r") as checkpoint_file:
+                return json.load(checkpoint_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def save(self, key, checkpoint):
+        path = self.get_path(key)
+        temporary_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            os.makedirs(self.folder, mode=0o700, exist_ok=True)
+            file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(file_descriptor, "w") as checkpoint_file:
+                json.dump(checkpoint, checkpoint_file)
+            os.replace(temporary_path, path)
+        except (IOError, OSError) as error:
+            logger.warning("Could not save checkpoint: {}".format(error))
+
+    def delete(self, key):
+        try:
+            os.remove(self.get_path(key))
+        except (IOError, OSError):
+            pass
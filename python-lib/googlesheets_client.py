@@ -0,0 +1,319 @@
+import copy
+import random
+import threading
+import time
+import gspread
+import requests
+from requests.adapters import HTTPAdapter
+from gspread.models import Spreadsheet
+from googlesheets_common import DSSConstants
+from googlesheets_cache import TTLCache
+from googlesheets_metrics import get_operation_name, get_endpoint_document_id, get_ranges_tabs, count_cells
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+RETRYABLE_HTTP_STATUSES = [429, 500, 502, 503, 504]
+RETRYABLE_API_STATUSES = ["RESOURCE_EXHAUSTED", "UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED"]
+
+SPREADSHEETS_API_V4_BASE_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+SPREADSHEET_URL = SPREADSHEETS_API_V4_BASE_URL + "/%s"
+SPREADSHEET_BATCH_UPDATE_URL = SPREADSHEETS_API_V4_BASE_URL + "/%s:batchUpdate"
+# Everything gspread's Spreadsheet and Worksheet objects need: title, and sheets ids, titles, positions and grid sizes
+SPREADSHEET_METADATA_FIELDS = "spreadsheetId,properties(title),sheets(properties(sheetId,title,index,sheetType,gridProperties(rowCount,columnCount)))"
+# Google APIs only compress responses for clients whose user agent contains "gzip"
+USER_AGENT = "dss-plugin-googlesheets/{} (gzip)".format(DSSConstants.PLUGIN_VERSION)
+
+# (client key, document id) -> spreadsheet metadata, dropped on any write to the document
+spreadsheets_metadata = TTLCache(ttl=DSSConstants.SPREADSHEET_METADATA_TTL)
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket, refilled at requests_per_minute / 60 tokens per second
+    and holding at most burst_seconds worth of tokens, so that short bursts go through
+    while no sliding minute sees much more than the per-minute quota.
+    """
+
+    def __init__(self, requests_per_minute, burst_seconds=DSSConstants.API_BURST_SECONDS):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+    def drain(self):
+        with self.lock:
+            self.tokens = 0
+            self.last_refill = time.monotonic()
+
+
+# Google quotas are per user and per minute, and are shared by all the sessions of a process
+_read_buckets = {}
+_write_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter giving a (connect, read) timeout to the requests sent without one, as gspread does not set any.
+    Stalled connections then fail with a Timeout error, which is retried, instead of blocking a worker forever.
+    """
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        HTTPAdapter.__init__(self, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return HTTPAdapter.send(self, request, timeout=timeout or self.timeout, **kwargs)
+
+
+# Keep-alive connections are pooled for the whole process, whatever the credentials of the client using them
+_http_adapter = None
+_http_adapter_lock = threading.Lock()
+
+
+def get_http_adapter():
+    global _http_adapter
+    with _http_adapter_lock:
+        if _http_adapter is None:
+            _http_adapter = TimeoutHTTPAdapter(
+                timeout=(DSSConstants.HTTP_CONNECT_TIMEOUT, DSSConstants.HTTP_READ_TIMEOUT),
+                pool_connections=DSSConstants.HTTP_POOL_CONNECTIONS,
+                pool_maxsize=DSSConstants.HTTP_POOL_SIZE
+            )
+        return _http_adapter
+
+
+def get_http_session():
+    """
+    Returns a requests session asking for gzip compressed responses, and using the shared connection pool.
+    Sessions are not shared, since gspread stores the client's authorization header in its session.
+    """
+    session = requests.Session()
+    http_adapter = get_http_adapter()
+    session.mount("https://", http_adapter)
+    session.mount("http://", http_adapter)
+    session.headers.update({
+        "Accept-Encoding": "gzip",
+        "User-Agent": USER_AGENT
+    })
+    return session
+
+
+def get_token_bucket(method, requests_per_minute):
+    buckets = _read_buckets if method.lower() == "get" else _write_buckets
+    with _buckets_lock:
+        if requests_per_minute not in buckets:
+            buckets[requests_per_minute] = TokenBucket(requests_per_minute)
+        return buckets[requests_per_minute]
+
+
+def get_api_error_status(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None, None
+    try:
+        error_status = response.json().get("error", {}).get("status")
+    except Exception:
+        error_status = None
+    return response.status_code, error_status
+
+
+def is_quota_error(error):
+    status_code, error_status = get_api_error_status(error)
+    return status_code == 429 or error_status == "RESOURCE_EXHAUSTED"
+
+
+def is_retryable_error(error, is_idempotent=True):
+    if not is_idempotent:
+        # An append or a structural change that failed on a server or network error may still have been applied,
+        # only quota errors are guaranteed to have been rejected before doing anything
+        return isinstance(error, gspread.exceptions.APIError) and is_quota_error(error)
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(error, gspread.exceptions.APIError):
+        status_code, error_status = get_api_error_status(error)
+        return status_code in RETRYABLE_HTTP_STATUSES or error_status in RETRYABLE_API_STATUSES
+    return False
+
+
+def get_backoff_delay(attempt):
+    # Truncated exponential backoff with full jitter, as recommended by Google
+    max_delay = min(DSSConstants.MAX_BACKOFF_DELAY, DSSConstants.INITIAL_BACKOFF_DELAY * (2 ** attempt))
+    return random.uniform(0, max_delay)
+
+
+def get_document_id(endpoint):
+    if not endpoint.startswith(SPREADSHEETS_API_V4_BASE_URL + "/"):
+        return None
+    path = endpoint[len(SPREADSHEETS_API_V4_BASE_URL) + 1:]
+    return path.split("/")[0].split(":")[0].split("?")[0]
+
+
+class CachedSpreadsheet(Spreadsheet):
+    """
+    gspread Spreadsheet whose metadata is shared through a short lived process-wide cache,
+    so that opening a document and listing its worksheets cost a single request.
+    Only the fields used by the plugin are requested, so that the metadata stays small
+    whatever the named ranges, protected ranges or conditional formats of the document.
+    """
+
+    def fetch_sheet_metadata(self, params=None):
+        if params is not None:
+            return self.client.request('get', SPREADSHEET_URL % self.id, params=params).json()
+        cache_key = (self.client.client_key, self.id)
+        metadata = spreadsheets_metadata.get(cache_key)
+        if metadata is None:
+            metadata = self.client.request('get', SPREADSHEET_URL % self.id, params={"fields": SPREADSHEET_METADATA_FIELDS}).json()
+            spreadsheets_metadata.set(cache_key, metadata)
+        # Worksheets keep a reference on their properties, they should not share the cached ones
+        return copy.deepcopy(metadata)
+
+    def batch_update(self, body, is_idempotent=True):
+        """
+        Requests adding or deleting rows or sheets should not be idempotent, so that they are not
+        retried after errors that do not guarantee they were rejected
+        """
+        return self.client.request('post', SPREADSHEET_BATCH_UPDATE_URL % self.id, json=body, is_idempotent=is_idempotent).json()
+
+
+class GoogleSheetsClient(gspread.Client):
+    """
+    gspread client whose every request goes through a token bucket sized to the Sheets
+    API per-minute quota, and is retried with exponential backoff on quota and transient errors.
+    """
+
+    def __init__(self, auth, session=None, requests_per_minute=DSSConstants.API_REQUESTS_PER_MINUTE, client_key=None):
+        gspread.Client.__init__(self, auth, session=session)
+        self.requests_per_minute = requests_per_minute
+        self.client_key = client_key
+        self.login_lock = threading.Lock()
+        # Clients are shared by sessions, each session using its own copy to collect the metrics of its own run
+        self.metrics = None
+        # Requests run on several threads, each one keeping the latency of its last request
+        self.last_requests = threading.local()
+
+    def get_session_client(self, metrics):
+        """
+        Returns a copy of the client recording its calls to metrics, and sharing everything else with the client:
+        HTTP session, authorization, rate limiters and cached metadata.
+        """
+        session_client = copy.copy(self)
+        session_client.metrics = metrics
+        return session_client
+
+    def record_call(self, method, endpoint, kwargs, response, **metrics):
+        operation = get_operation_name(method, endpoint)
+        request_bytes = response_bytes = 0
+        if response is not None:
+            request_bytes = len(response.request.body or b"")
+            response_bytes = len(response.content or b"")
+        if self.metrics is not None:
+            self.metrics.record_call(
+                operation,
+                document_id=get_endpoint_document_id(endpoint),
+                tabs=get_ranges_tabs(endpoint, kwargs.get("params")),
+                request_bytes=request_bytes,
+                response_bytes=response_bytes,
+                cells=count_cells(kwargs.get("json")),
+                **metrics
+            )
+
+    def get_last_latency(self):
+        """
+        Returns the time spent waiting for the API in the last successful request of the calling thread,
+        without the time spent in the rate limiter and in backoff, or None if there was no such request.
+        """
+        return getattr(self.last_requests, "latency", None)
+
+    def record_cells(self, method, endpoint, cells):
+        operation = get_operation_name(method, endpoint)
+        if self.metrics is not None:
+            self.metrics.record_cells(operation, cells)
+
+    def ensure_valid_token(self):
+        # Clients are cached for the life of the process, so their token may expire between two calls
+        if getattr(self.auth, "access_token_expired", False):
+            with self.login_lock:
+                if self.auth.access_token_expired:
+                    logger.info("Access token expired, refreshing it")
+                    self.login()
+
+    def invalidate_metadata(self, endpoint):
+        # Writes may resize or rename sheets, so the cached metadata of the document is dropped
+        document_id = get_document_id(endpoint)
+        if document_id:
+            spreadsheets_metadata.invalidate(lambda cache_key: cache_key[1] == document_id)
+
+    def open_by_key(self, key):
+        try:
+            return CachedSpreadsheet(self, {'id': key})
+        except gspread.exceptions.APIError as error:
+            if error.response.status_code == 404:
+                raise gspread.exceptions.SpreadsheetNotFound
+            raise error
+
+    def request(self, method, endpoint, *args, **kwargs):
+        token_bucket = get_token_bucket(method, self.requests_per_minute)
+        is_idempotent = kwargs.pop("is_idempotent", not endpoint.endswith(":append"))
+        attempt = 0
+        quota_errors = 0
+        # Time spent in the rate limiter and in backoff is kept apart from the API latency
+        throttle_time = 0.0
+        latency = 0.0
+        while True:
+            throttle_start = time.monotonic()
+            token_bucket.acquire()
+            self.ensure_valid_token()
+            call_start = time.monotonic()
+            throttle_time += call_start - throttle_start
+            try:
+                response = gspread.Client.request(self, method, endpoint, *args, **kwargs)
+                latency += time.monotonic() - call_start
+                self.last_requests.latency = latency
+                if method.lower() != "get":
+                    self.invalidate_metadata(endpoint)
+                self.record_call(
+                    method, endpoint, kwargs, response,
+                    latency=latency, throttle_time=throttle_time, retries=attempt, quota_errors=quota_errors
+                )
+                return response
+            except Exception as error:
+                latency += time.monotonic() - call_start
+                if is_quota_error(error):
+                    quota_errors += 1
+                if not is_retryable_error(error, is_idempotent) or attempt >= DSSConstants.MAX_RETRIES:
+                    self.record_call(
+                        method, endpoint, kwargs, getattr(error, "response", None),
+                        latency=latency, throttle_time=throttle_time, retries=attempt, quota_errors=quota_errors, failed=True
+                    )
+                    raise
+                if is_quota_error(error):
+                    token_bucket.drain()
+                delay = get_backoff_delay(attempt)
+                attempt += 1
+                logger.warning("Retrying request {} {} in {:.1f}s (attempt {}/{}) after error: {}".format(
+                    method.upper(), endpoint, delay, attempt, DSSConstants.MAX_RETRIES, error
+                ))
+                time.sleep(delay)
+                throttle_time += delay
+
+
+def authorize(credentials, requests_per_minute=DSSConstants.API_REQUESTS_PER_MINUTE, client_key=None):
+    client = GoogleSheetsClient(auth=credentials, session=get_http_session(), requests_per_minute=requests_per_minute, client_key=client_key)
+    client.login()
+    return client
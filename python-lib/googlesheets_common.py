@@ -1,4 +1,5 @@
 import datetime
+import re
 
 
 class DSSConstants(object):
@@ -9,9 +10,37 @@ class DSSConstants(object):
         "single-sign-on": "There is a problem with the selected Single Sign On preset"
     }
     DEFAULT_DATASET_FORMAT = {'separator': '\t', 'style': 'unix', 'compress': ''}
-    PLUGIN_VERSION = '1.2.0'
+    PLUGIN_VERSION = '1.3.0'
     DSS_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
     GSPREAD_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+    DEFAULT_READ_WINDOW_SIZE = 10000
+    MAX_CELLS_PER_READ_REQUEST = 500000
+    MAX_RANGES_PER_READ_REQUEST = 50
+    MAX_CELLS_PER_WRITE_REQUEST = 100000
+    MAX_BYTES_PER_WRITE_REQUEST = 2000000
+    MAX_CELLS_PER_DOCUMENT = 10000000
+    MIN_BYTES_PER_WRITE_REQUEST = 10000
+    INPUT_CHUNK_SIZE = 10000
+    FAST_WRITE_LATENCY = 2
+    SLOW_WRITE_LATENCY = 10
+    API_REQUESTS_PER_MINUTE = 60
+    API_BURST_SECONDS = 5
+    DEFAULT_UPLOAD_WORKERS = 4
+    DEFAULT_IMPORT_WORKERS = 4
+    SPREADSHEET_METADATA_TTL = 30
+    TABS_TITLES_CACHE_TTL = 600
+    REFRESH_STATES_TTL = 7 * 24 * 3600
+    SCHEMA_INFERENCE_SAMPLE_ROWS = 1000
+    MAX_RETRIES = 8
+    INITIAL_BACKOFF_DELAY = 1
+    MAX_BACKOFF_DELAY = 64
+    HTTP_POOL_CONNECTIONS = 4
+    HTTP_POOL_SIZE = 16
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_READ_TIMEOUT = 180
+    CHECKPOINT_TTL = 7 * 24 * 3600
+    PARTITION_DIMENSION = "tab"
+    PARTITION_PLACEHOLDER = "%{tab}"
 
 
 def extract_credentials(config, can_raise=True):
@@ -65,35 +94,99 @@ def get_tab_ids(config):
     return tabs_ids
 
 
-def get_unique_slugs(list_of_names):
+def get_upsert_keys(config):
+    # Comma separated names of the columns identifying the rows in upsert mode
+    upsert_keys = config.get("upsert_keys") or ""
+    return [key.strip() for key in upsert_keys.split(",") if key.strip()]
+
+
+def get_number_of_workers(config, parameter_name, default):
+    # Workers beyond the size of the shared connection pool would only wait for a connection
+    number_of_workers = config.get(parameter_name) or default
+    return max(min(number_of_workers, DSSConstants.HTTP_POOL_SIZE), 1)
+
+
+def get_partition_tab_title(tabs_pattern, partition_id):
+    # Sales %{tab}, 2024-01 -> Sales 2024-01
+    return (tabs_pattern or DSSConstants.PARTITION_PLACEHOLDER).replace(DSSConstants.PARTITION_PLACEHOLDER, partition_id)
+
+
+def get_tab_partition_id(tabs_pattern, tab_title):
+    """
+    Returns the id of the partition stored in a tab, or None if the tab title does not match the pattern
+    """
+    prefix, _, suffix = (tabs_pattern or DSSConstants.PARTITION_PLACEHOLDER).partition(DSSConstants.PARTITION_PLACEHOLDER)
+    match = re.match("^{}(.+){}$".format(re.escape(prefix), re.escape(suffix)), tab_title)
+    return match.group(1) if match else None
+
+
+class UniqueNamesAllocator(object):
+    """
+    Gives unique names, suffixing with _1, _2... the names already given.
+    Names are first normalized (for instance slugified), empty names become 'none'.
+    The given names are kept in a set, with the next suffix to try for each name, so that
+    allocating n names is linear, and gives the same names as a search from _1 each time.
+    """
+
+    def __init__(self, normalize=None, existing_names=None):
+        self.normalize = normalize
+        self.allocated_names = set()
+        self.next_suffixes = {}
+        for name in existing_names or []:
+            self.allocate(name)
+
+    def allocate(self, name):
+        base_name = self.normalize(name) if self.normalize else name
+        if base_name == '':
+            base_name = 'none'
+        unique_name = base_name
+        if unique_name in self.allocated_names:
+            suffix = self.next_suffixes.get(base_name, 1)
+            unique_name = base_name + '_' + str(suffix)
+            while unique_name in self.allocated_names:
+                suffix += 1
+                unique_name = base_name + '_' + str(suffix)
+            self.next_suffixes[base_name] = suffix + 1
+        self.allocated_names.add(unique_name)
+        return unique_name
+
+
+def slugify_name(name):
     from slugify import slugify
-    list_unique_slugs = []
-    for name in list_of_names:
-        slug_name = slugify(name, separator="_", lowercase=False)
-        if slug_name == '':
-            slug_name = 'none'
-        test_string = slug_name
-        i = 0
-        while test_string in list_unique_slugs:
-            i += 1
-            test_string = slug_name + '_' + str(i)
-        list_unique_slugs.append(test_string)
-    return list_unique_slugs
+    return slugify(name, separator="_", lowercase=False)
+
+
+def get_unique_slugs(list_of_names):
+    allocator = UniqueNamesAllocator(normalize=slugify_name)
+    return [allocator.allocate(name) for name in list_of_names]
 
 
 def get_unique_names(list_of_names):
-    list_unique_slugs = []
-    for name in list_of_names:
-        slug_name = name
-        if slug_name == '':
-            slug_name = 'none'
-        test_string = slug_name
-        i = 0
-        while test_string in list_unique_slugs:
-            i += 1
-            test_string = slug_name + '_' + str(i)
-        list_unique_slugs.append(test_string)
-    return list_unique_slugs
+    allocator = UniqueNamesAllocator()
+    return [allocator.allocate(name) for name in list_of_names]
+
+
+def get_read_last_row(lines_to_skip, result_format, records_limit=-1):
+    """
+    Returns the last sheet row to read for records_limit records, or None to read the whole sheet.
+    Only the skipped lines, the header and the rows needed for the preview / sample are asked to the API.
+    """
+    if records_limit is None or records_limit <= 0:
+        return None
+    header_rows = 1 if result_format == 'first-row-header' else 0
+    return lines_to_skip + header_rows + records_limit
+
+
+def pad_row(row, number_of_columns):
+    if len(row) < number_of_columns:
+        row = row + [""] * (number_of_columns - len(row))
+    return row
+
+
+def pad_rows(rows):
+    # Same as gspread's fill_gaps: all rows get the width of the widest one
+    number_of_columns = max([len(row) for row in rows] or [0])
+    return [pad_row(row, number_of_columns) for row in rows]
 
 
 def mark_date_columns(schema):
@@ -119,8 +212,26 @@ def format_date(date, from_format, to_format):
         return date
 
 
+# Dates written by DSS, such as 2024-09-10T13:45:02.123Z
+DSS_DATE_REGEX = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d{1,6})?Z")
+
+
+def convert_dss_date(date):
+    # DSS_DATE_FORMAT to GSPREAD_DATE_FORMAT is only a matter of keeping the date and time parts,
+    # so well formed dates are sliced, and only the other ones go through strptime / strftime
+    if date and DSS_DATE_REGEX.fullmatch(date):
+        return date[:10] + " " + date[11:19]
+    return format_date(date, DSSConstants.DSS_DATE_FORMAT, DSSConstants.GSPREAD_DATE_FORMAT)
+
+
 def convert_dates_in_row(row, date_columns):
     for date_column in date_columns:
-        row[date_column] = format_date(
-            row[date_column], DSSConstants.DSS_DATE_FORMAT, DSSConstants.GSPREAD_DATE_FORMAT)
+        row[date_column] = convert_dss_date(row[date_column])
     return row
+
+
+def convert_dates_in_rows(rows, date_columns):
+    for date_column in date_columns:
+        for row in rows:
+            row[date_column] = convert_dss_date(row[date_column])
+    return rows
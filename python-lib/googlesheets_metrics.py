@@ -0,0 +1,195 @@
+import json
+import threading
+import time
+from urllib.parse import unquote
+
+
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files/"
+SPREADSHEETS_URL = "https://sheets.googleapis.com/v4/spreadsheets/"
+
+
+class APIMetrics(object):
+    """
+    Thread safe aggregation of the Google API calls made during a run, per operation
+    (values.batchGet, values.update, batchUpdate...).
+    Latencies include retries but not the time spent waiting for the rate limiter, which is counted apart.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.operations = {}
+            self.documents = set()
+            self.tabs = set()
+
+    def get_operation(self, operation):
+        if operation not in self.operations:
+            self.operations[operation] = {
+                "calls": 0,
+                "failures": 0,
+                "retries": 0,
+                "quota_errors": 0,
+                "latencies": [],
+                "throttle_time": 0.0,
+                "request_bytes": 0,
+                "response_bytes": 0,
+                "cells": 0
+            }
+        return self.operations[operation]
+
+    def record_call(self, operation, document_id=None, tabs=None, latency=0.0, throttle_time=0.0,
+                    request_bytes=0, response_bytes=0, cells=0, retries=0, quota_errors=0, failed=False):
+        with self.lock:
+            operation_metrics = self.get_operation(operation)
+            operation_metrics["calls"] += 1
+            operation_metrics["failures"] += 1 if failed else 0
+            operation_metrics["retries"] += retries
+            operation_metrics["quota_errors"] += quota_errors
+            operation_metrics["latencies"].append(latency)
+            operation_metrics["throttle_time"] += throttle_time
+            operation_metrics["request_bytes"] += request_bytes
+            operation_metrics["response_bytes"] += response_bytes
+            operation_metrics["cells"] += cells
+            if document_id:
+                self.documents.add(document_id)
+            for tab in tabs or []:
+                self.tabs.add(tab)
+
+    def record_cells(self, operation, cells):
+        # Cells read are only known once the response has been parsed by the caller
+        with self.lock:
+            self.get_operation(operation)["cells"] += cells
+
+    def get_summary(self):
+        with self.lock:
+            operations = {}
+            for operation, operation_metrics in self.operations.items():
+                latencies = sorted(operation_metrics["latencies"])
+                operations[operation] = {
+                    "calls": operation_metrics["calls"],
+                    "failures": operation_metrics["failures"],
+                    "retries": operation_metrics["retries"],
+                    "quota_errors": operation_metrics["quota_errors"],
+                    "total_latency": sum(latencies),
+                    "p50_latency": get_percentile(latencies, 0.5),
+                    "p95_latency": get_percentile(latencies, 0.95),
+                    "max_latency": latencies[-1] if latencies else 0.0,
+                    "throttle_time": operation_metrics["throttle_time"],
+                    "request_bytes": operation_metrics["request_bytes"],
+                    "response_bytes": operation_metrics["response_bytes"],
+                    "cells": operation_metrics["cells"]
+                }
+            summary = {
+                "duration": time.time() - self.start_time,
+                "documents": sorted(self.documents),
+                "tabs": sorted(self.tabs),
+                "operations": operations
+            }
+        for total in ["calls", "failures", "retries", "quota_errors", "total_latency", "throttle_time", "request_bytes", "response_bytes", "cells"]:
+            summary[total] = sum(operation[total] for operation in operations.values())
+        return summary
+
+    def log_summary(self, logger, label, metrics_file=None):
+        """
+        Logs the summary of the calls made since the last reset, saves it as JSON to metrics_file if set, and resets the metrics.
+        """
+        summary = self.get_summary()
+        summary["label"] = label
+        logger.info(
+            "{}: {} API calls in {:.1f}s, {:.1f}s waiting for the API, {:.1f}s throttled, {} retries ({} on quota errors), "
+            "{:.0f}kB sent, {:.0f}kB received, {} cells".format(
+                label, summary["calls"], summary["duration"], summary["total_latency"], summary["throttle_time"],
+                summary["retries"], summary["quota_errors"], summary["request_bytes"] / 1024.0, summary["response_bytes"] / 1024.0,
+                summary["cells"]
+            )
+        )
+        for operation, operation_metrics in sorted(summary["operations"].items()):
+            logger.info(
+                "{} {}: {} calls ({} failed), latency p50 {:.0f}ms p95 {:.0f}ms max {:.0f}ms, {} retries, {} cells".format(
+                    label, operation, operation_metrics["calls"], operation_metrics["failures"],
+                    1000 * operation_metrics["p50_latency"], 1000 * operation_metrics["p95_latency"], 1000 * operation_metrics["max_latency"],
+                    operation_metrics["retries"], operation_metrics["cells"]
+                )
+            )
+        if metrics_file:
+            try:
+                with open(metrics_file, "w") as file:
+                    json.dump(summary, file, indent=2)
+            except Exception as error:
+                logger.warning("Could not save the API metrics to {}: {}".format(metrics_file, error))
+        self.reset()
+        return summary
+
+
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * percentile), len(sorted_values) - 1)]
+
+
+def get_operation_name(method, endpoint):
+    """
+    https://sheets.googleapis.com/v4/spreadsheets/<id>/values/'Sheet 1'!A1:B2:append -> values.append
+    """
+    if endpoint.startswith(DRIVE_FILES_URL):
+        return "drive.files.{}".format(method.lower())
+    if not endpoint.startswith(SPREADSHEETS_URL):
+        return "{} {}".format(method.upper(), endpoint.split("?")[0])
+    path = endpoint[len(SPREADSHEETS_URL):].split("?")[0]
+    if "/values" in path:
+        values_path = path.split("/values", 1)[1]
+        if values_path.startswith(":"):
+            return "values.{}".format(values_path[1:])
+        # Ranges are URL encoded, so the only unencoded colon is the one of the custom method
+        for custom_method in ["append", "clear"]:
+            if values_path.endswith(":" + custom_method):
+                return "values.{}".format(custom_method)
+        return "values.get" if method.lower() == "get" else "values.update"
+    if ":" in path:
+        return path.rsplit(":", 1)[-1]
+    return "get" if method.lower() == "get" else method.lower()
+
+
+def get_endpoint_document_id(endpoint):
+    for root in [SPREADSHEETS_URL, DRIVE_FILES_URL]:
+        if endpoint.startswith(root):
+            return endpoint[len(root):].split("/")[0].split(":")[0].split("?")[0]
+    return None
+
+
+def get_ranges_tabs(endpoint, params=None):
+    """
+    Returns the titles of the tabs targeted by a values call, from the range in its URL or its ranges parameter
+    """
+    a1_ranges = list((params or {}).get("ranges") or [])
+    if "/values/" in endpoint:
+        a1_range = unquote(endpoint.split("/values/", 1)[1].split("?")[0])
+        for suffix in [":append", ":clear"]:
+            if a1_range.endswith(suffix):
+                a1_range = a1_range[:-len(suffix)]
+        a1_ranges.append(a1_range)
+    tabs = []
+    for a1_range in a1_ranges:
+        title = a1_range.rsplit("!", 1)[0] if "!" in a1_range else a1_range
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+        tabs.append(title)
+    return tabs
+
+
+def count_cells(body):
+    """
+    Number of cells sent in a values.update, values.append or values.batchUpdate body
+    """
+    if not isinstance(body, dict):
+        return 0
+    value_ranges = body.get("data") if isinstance(body.get("data"), list) else [body]
+    cells = 0
+    for value_range in value_ranges:
+        for row in value_range.get("values") or []:
+            cells += len(row)
+    return cells
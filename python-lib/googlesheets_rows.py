@@ -0,0 +1,80 @@
+import itertools
+import json
+
+
+def peek_rows_width(rows, sample_size=None):
+    """
+    Returns the length of the widest of the first sample_size rows (all rows if not set),
+    and an iterator over all the rows. The values API trims the trailing empty cells of each row,
+    so the width of the sheet can only be known by looking at its rows.
+    """
+    if sample_size is None or sample_size <= 0:
+        sample = list(rows)
+    else:
+        sample = list(itertools.islice(rows, sample_size))
+    width = max([len(row) for row in sample] or [0])
+    return width, itertools.chain(sample, rows)
+
+
+def iter_header_records(rows, keys, sheet_key=None, sheet_name=None, converters=None, get_extra_key=None):
+    """
+    Yields one dict per row, indexed by the precomputed keys. Rows are padded with "" to the number of keys,
+    and the sheet name, if any, is stored under sheet_key.
+    converters optionally maps keys to functions applied to their values.
+    Rows longer than the keys are truncated, unless get_extra_key is set, in which case it is called
+    to get the key of each extra column, as for a column with a blank header.
+    """
+    keys = list(keys)
+    number_of_columns = len(keys)
+    padding = [""] * number_of_columns
+    converters = list((converters or {}).items())
+    for row in rows:
+        if len(row) < number_of_columns:
+            row = row + padding[len(row):]
+        elif len(row) > number_of_columns and get_extra_key is not None:
+            keys.extend(get_extra_key() for _ in range(len(row) - number_of_columns))
+            number_of_columns = len(keys)
+            padding = [""] * number_of_columns
+        if sheet_key is None:
+            record = dict(zip(keys, row))
+        else:
+            record = {sheet_key: sheet_name}
+            record.update(zip(keys, row))
+        for key, converter in converters:
+            record[key] = converter(record[key])
+        yield record
+
+
+def iter_no_header_records(rows, sheet_name=None, number_of_columns=0):
+    """
+    Yields one dict per row indexed by 1-based column numbers, the sheet name, if any, being column 1.
+    Rows are padded to number_of_columns, usually the width of the sheet, so that all rows have the same keys.
+    Longer rows keep all their values.
+    """
+    first_key = 1 if sheet_name is None else 2
+    keys = tuple(range(first_key, first_key + number_of_columns))
+    padding = [""] * number_of_columns
+    for row in rows:
+        if len(row) < number_of_columns:
+            row = row + padding[len(row):]
+        elif len(row) > len(keys):
+            keys = tuple(range(first_key, first_key + len(row)))
+        if sheet_name is None:
+            record = dict(zip(keys, row))
+        else:
+            record = {1: sheet_name}
+            record.update(zip(keys, row))
+        yield record
+
+
+def iter_json_records(rows, sheet_name=None, number_of_columns=0):
+    """
+    Yields one {"json": ...} dict per row, padded to number_of_columns, usually the width of the sheet.
+    """
+    padding = [""] * number_of_columns
+    for row in rows:
+        if len(row) < number_of_columns:
+            row = row + padding[len(row):]
+        if sheet_name is not None:
+            row = [sheet_name] + row
+        yield {"json": json.dumps(row)}
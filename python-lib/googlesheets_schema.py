@@ -0,0 +1,85 @@
+import datetime
+
+
+SPREADSHEET_EPOCH = datetime.datetime(1899, 12, 30)
+DATE_NUMBER_FORMATS = ["DATE", "DATE_TIME"]
+
+
+def infer_column_type(values, number_formats=None):
+    """
+    Infers the DSS type of a column from a sample of its unformatted values.
+    Empty cells are ignored, and numbers formatted as dates in the sheet are dates.
+    """
+    values_types = set(type(value) for value in values if value != "" and value is not None)
+    if not values_types:
+        return "string"
+    if values_types == {bool}:
+        return "boolean"
+    if not values_types <= {int, float}:
+        return "string"
+    number_formats = set(number_formats or [])
+    if number_formats and number_formats <= set(DATE_NUMBER_FORMATS):
+        return "date"
+    if values_types == {int} or all(value == int(value) for value in values if isinstance(value, float)):
+        return "bigint"
+    return "double"
+
+
+def merge_column_types(first_type, second_type):
+    if first_type is None:
+        return second_type
+    if first_type == second_type:
+        return first_type
+    if {first_type, second_type} == {"bigint", "double"}:
+        return "double"
+    return "string"
+
+
+def infer_schema(columns_names, rows, columns_number_formats=None):
+    """
+    Returns the DSS schema columns for a sample of rows, as a list of {"name", "type"} dicts.
+    columns_number_formats optionally gives, for each column, the set of number format types of its cells.
+    """
+    columns_number_formats = columns_number_formats or []
+    schema_columns = []
+    for column_index, column_name in enumerate(columns_names):
+        values = [row[column_index] for row in rows if column_index < len(row)]
+        number_formats = columns_number_formats[column_index] if column_index < len(columns_number_formats) else None
+        schema_columns.append({
+            "name": column_name,
+            "type": infer_column_type(values, number_formats)
+        })
+    return schema_columns
+
+
+def get_columns_number_formats(grid_data):
+    """
+    Takes the rowData of a spreadsheets.get response restricted to effectiveFormat.numberFormat.type
+    and returns the set of number format types found in each column.
+    """
+    columns_number_formats = []
+    for row_data in grid_data:
+        for column_index, cell in enumerate(row_data.get("values", [])):
+            while len(columns_number_formats) <= column_index:
+                columns_number_formats.append(set())
+            number_format_type = cell.get("effectiveFormat", {}).get("numberFormat", {}).get("type")
+            if number_format_type:
+                columns_number_formats[column_index].add(number_format_type)
+    return columns_number_formats
+
+
+def serial_number_to_date(serial_number):
+    """
+    Converts a spreadsheet serial number (days since 1899-12-30) to the DSS date format.
+    Sheets have no time zone information, dates are considered UTC.
+    """
+    if isinstance(serial_number, bool) or not isinstance(serial_number, (int, float)):
+        return serial_number
+    date = SPREADSHEET_EPOCH + datetime.timedelta(days=serial_number)
+    return "{}.{:03d}Z".format(date.strftime("%Y-%m-%dT%H:%M:%S"), date.microsecond // 1000)
+
+
+def get_dss_types(dataset_schema):
+    if not dataset_schema:
+        return {}
+    return {column.get("name"): column.get("type", "string") for column in dataset_schema.get("columns", [])}
@@ -0,0 +1,65 @@
+import pandas
+from googlesheets_common import DSSConstants
+from googlesheets_writer import estimate_row_bytes
+
+
+def format_iso_dates(dates):
+    """
+    Formats a datetime series like datetime.isoformat would, one column operation at a time:
+    microseconds only when not null, and the UTC offset of time zone aware dates.
+    """
+    formatted_dates = dates.dt.strftime("%Y-%m-%dT%H:%M:%S")
+    has_microseconds = dates.dt.microsecond != 0
+    if has_microseconds.any():
+        formatted_dates = formatted_dates.where(~has_microseconds, formatted_dates + dates.dt.strftime(".%f"))
+    if dates.dt.tz is not None:
+        offsets = dates.dt.strftime("%z")
+        formatted_dates = formatted_dates + offsets.str[:3] + ":" + offsets.str[3:]
+    return formatted_dates
+
+
+def iter_dataset_dataframes(dataset, chunksize=DSSConstants.INPUT_CHUNK_SIZE):
+    """
+    Iterates over a DSS dataset by dataframes of chunksize rows, typed after the dataset schema.
+    Integer columns with empty cells are read as nullable integers, and only empty cells are missing
+    values: strings such as "NA", "null" or "nan" are kept as they are, as when reading rows.
+    """
+    return dataset.iter_dataframes(
+        chunksize=chunksize,
+        infer_with_pandas=False,
+        use_nullable_integers=True,
+        keep_default_na=False,
+        na_values=[""]
+    )
+
+
+def serialize_dataframe(dataframe, value_input_option="USER_ENTERED"):
+    """
+    Returns the rows of a dataframe as lists of JSON serializable values for the Sheets API.
+    Dates are formatted for Google Sheets to parse them when USER_ENTERED, as ISO 8601 otherwise,
+    and missing values (None, NaN, NaT) are sent as empty cells.
+    """
+    columns_values = []
+    for column_index in range(len(dataframe.columns)):
+        column = dataframe.iloc[:, column_index]
+        if pandas.api.types.is_datetime64_any_dtype(column.dtype):
+            if value_input_option == "USER_ENTERED":
+                column = column.dt.strftime(DSSConstants.GSPREAD_DATE_FORMAT)
+            else:
+                column = format_iso_dates(column)
+        else:
+            column = column.astype(object)
+        columns_values.append(column.where(column.notnull(), "").tolist())
+    # Transposing lists of python values is much cheaper than converting the whole dataframe to objects
+    return [list(row) for row in zip(*columns_values)]
+
+
+def estimate_rows_bytes(rows, sample_size=100):
+    """
+    Average JSON size of the rows, estimated on a sample of them
+    """
+    if not rows:
+        return 0
+    step = max(len(rows) // sample_size, 1)
+    sample = rows[::step]
+    return sum(estimate_row_bytes(row) for row in sample) // len(sample)
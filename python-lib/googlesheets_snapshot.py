@@ -0,0 +1,107 @@
+import gzip
+import itertools
+import json
+import os
+import tempfile
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+
+class SnapshotStore(object):
+    """
+    Local gzipped copies of the rows read from a document, tagged with the document version
+    at the time of the read. When the version has not changed, rows are served from the copy
+    instead of being downloaded again.
+    Each snapshot is made of a JSON lines data file, one [sheet title, row] per line,
+    and of a JSON meta file holding the version and the rows count of each sheet.
+    """
+
+    def __init__(self, folder=None):
+        self.folder = folder or os.path.join(tempfile.gettempdir(), "dss-plugin-googlesheets", "snapshots")
+
+    def get_paths(self, key):
+        return os.path.join(self.folder, "{}.json".format(key)), os.path.join(self.folder, "{}.jsonl.gz".format(key))
+
+    def get_meta(self, key, version):
+        meta_path, data_path = self.get_paths(key)
+        try:
+            with open(meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if version is None or meta.get("version") != version or not os.path.isfile(data_path):
+            return None
+        return meta
+
+    def iter_worksheets_rows(self, key):
+        """
+        Yields (sheet title, rows) for each sheet of the snapshot, in the order they were read.
+        """
+        _, data_path = self.get_paths(key)
+        with gzip.open(data_path, "rt") as data_file:
+            lines = (json.loads(line) for line in data_file)
+            for worksheet_title, lines_of_worksheet in itertools.groupby(lines, key=lambda line: line[0]):
+                yield worksheet_title, (line[1] for line in lines_of_worksheet)
+
+    def record(self, key, version, worksheets_rows):
+        """
+        Passes through the (sheet title, rows) of worksheets_rows while writing them to a new snapshot.
+        The snapshot is only kept if worksheets_rows is entirely consumed.
+        """
+        if version is None:
+            for worksheet_title, rows in worksheets_rows:
+                yield worksheet_title, rows
+            return
+        meta_path, data_path = self.get_paths(key)
+        temporary_data_path = "{}.{}.tmp".format(data_path, os.getpid())
+        try:
+            os.makedirs(self.folder, mode=0o700, exist_ok=True)
+            file_descriptor = os.open(temporary_data_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            raw_file = os.fdopen(file_descriptor, "wb")
+            data_file = gzip.open(raw_file, "wt", compresslevel=DEFAULT_COMPRESS_LEVEL)
+        except (IOError, OSError) as error:
+            logger.warning("Could not create snapshot: {}".format(error))
+            for worksheet_title, rows in worksheets_rows:
+                yield worksheet_title, rows
+            return
+        worksheets_meta = {}
+        is_complete = False
+        try:
+            for worksheet_title, rows in worksheets_rows:
+                worksheet_meta = {"rows": 0}
+                worksheets_meta[worksheet_title] = worksheet_meta
+                recorded_rows = self.record_rows(data_file, worksheet_title, rows, worksheet_meta)
+                yield worksheet_title, recorded_rows
+                for _ in recorded_rows:
+                    pass
+            is_complete = True
+        finally:
+            data_file.close()
+            raw_file.close()
+            if is_complete:
+                self.commit(meta_path, data_path, temporary_data_path, {"version": version, "sheets": worksheets_meta})
+            elif os.path.isfile(temporary_data_path):
+                os.remove(temporary_data_path)
+
+    def record_rows(self, data_file, worksheet_title, rows, worksheet_meta):
+        for row in rows:
+            line = json.dumps([worksheet_title, row])
+            data_file.write(line)
+            data_file.write("\n")
+            worksheet_meta["rows"] += 1
+            yield row
+
+    def commit(self, meta_path, data_path, temporary_data_path, meta):
+        try:
+            os.replace(temporary_data_path, data_path)
+            temporary_meta_path = "{}.{}.tmp".format(meta_path, os.getpid())
+            file_descriptor = os.open(temporary_meta_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(file_descriptor, "w") as meta_file:
+                json.dump(meta, meta_file)
+            os.replace(temporary_meta_path, meta_path)
+        except (IOError, OSError) as error:
+            logger.warning("Could not save snapshot: {}".format(error))
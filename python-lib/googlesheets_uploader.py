@@ -0,0 +1,189 @@
+import hashlib
+import json
+import threading
+import time
+from googlesheets import get_last_row_of_range
+from googlesheets_append import append_rows
+from googlesheets_common import DSSConstants
+from googlesheets_serialization import serialize_dataframe, estimate_rows_bytes
+from googlesheets_upsert import WorksheetUpsertWriter
+from googlesheets_writer import WorksheetRangesWriter, BatchSizer, estimate_row_bytes, get_api_latency
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+
+def update_hash(input_hash, rows):
+    for row in rows:
+        input_hash.update(json.dumps(row, default=str).encode("utf-8"))
+        input_hash.update(b"\n")
+
+
+class WorksheetUploader(object):
+    """
+    Upload loop of the append recipe, fed with chunks of the input dataset.
+    Rows are cut in batches by a BatchSizer. In append mode, the first batch is appended to find
+    where the existing table ends, and the next ones are written to the following explicit row ranges
+    by a WorksheetRangesWriter, several at a time, while the next chunks are being read. In overwrite mode,
+    the sheet is cleared and all the batches, column names first, go to explicit ranges. In upsert mode,
+    rows are only compared to the sheet, and the changes are sent on close.
+    With a checkpoints store, the rows written without gap are recorded as batches are acknowledged,
+    and a failed run is resumed after them, rewriting the following rows to the same ranges.
+    iter_input should then return a new iterator over the chunks of the input, so that the first rows
+    of the input can be checked against the ones written by the failed run before resuming it.
+    """
+
+    def __init__(self, session, worksheet, value_input_option, columns, write_mode="append", upsert_keys=None, batch_size=200,
+                 adaptive_batch_size=True, number_of_workers=DSSConstants.DEFAULT_UPLOAD_WORKERS, insertion_delay=0,
+                 checkpoints=None, checkpoint_key=None, iter_input=None):
+        self.session = session
+        self.worksheet = worksheet
+        self.worksheet.append_rows = append_rows.__get__(worksheet, worksheet.__class__)
+        self.value_input_option = value_input_option
+        self.write_mode = write_mode
+        self.number_of_workers = number_of_workers
+        self.insertion_delay = insertion_delay
+        self.batch_sizer = BatchSizer(batch_size, adaptive=adaptive_batch_size)
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_cells = 0
+        self.ranges_writer = None
+        self.upsert_writer = None
+        # Upserts only send what differs from the sheet, so they do not need checkpoints
+        self.checkpoints = checkpoints if write_mode != "upsert" else None
+        self.checkpoint_key = checkpoint_key
+        self.iter_input = iter_input
+        self.first_input_row = None
+        self.rows_to_skip = 0
+        # Hash of the input rows so far, and its value at the last row of each batch in flight
+        self.input_hash = hashlib.sha256()
+        self.batches_hashes = {}
+        self.hashes_lock = threading.Lock()
+        checkpoint = self.load_checkpoint()
+        if write_mode == "upsert":
+            self.upsert_writer = WorksheetUpsertWriter(session, worksheet, columns, upsert_keys, value_input_option)
+        elif checkpoint:
+            self.first_input_row = checkpoint["first_row"]
+            self.rows_to_skip = checkpoint["input_rows"]
+            self.ranges_writer = self.get_ranges_writer(self.first_input_row + self.rows_to_skip)
+        elif write_mode == "overwrite":
+            worksheet.clear()
+            self.batch.append(list(columns))
+            self.batch_bytes, self.batch_cells = estimate_row_bytes(columns), len(columns)
+            self.first_input_row = 2
+            self.ranges_writer = self.get_ranges_writer(1)
+
+    def load_checkpoint(self):
+        if self.checkpoints is None:
+            return None
+        checkpoint = self.checkpoints.load(self.checkpoint_key)
+        if not checkpoint:
+            return None
+        if self.iter_input is None or self.get_input_hash(checkpoint["input_rows"]) != checkpoint.get("input_hash"):
+            logger.warning("The input has changed since the failed run, starting over")
+            self.checkpoints.delete(self.checkpoint_key)
+            return None
+        last_checkpoint_row = checkpoint["first_row"] + checkpoint["input_rows"] - 1
+        if self.session.get_last_rows([self.worksheet]).get(self.worksheet.title, 0) < last_checkpoint_row:
+            logger.warning("Sheet '{}' has changed since the failed run, starting over".format(self.worksheet.title))
+            return None
+        logger.info("Resuming the failed run: {} rows were already written to sheet '{}'".format(checkpoint["input_rows"], self.worksheet.title))
+        return checkpoint
+
+    def get_input_hash(self, number_of_rows):
+        # Hash of the first rows of the input, or None if it has less rows
+        input_hash = hashlib.sha256()
+        for dataframe in self.iter_input():
+            rows = serialize_dataframe(dataframe, self.value_input_option)[:number_of_rows]
+            update_hash(input_hash, rows)
+            number_of_rows -= len(rows)
+            if number_of_rows <= 0:
+                break
+        return input_hash.hexdigest() if number_of_rows == 0 else None
+
+    def save_checkpoint(self, committed_row):
+        if self.checkpoints is None:
+            return
+        with self.hashes_lock:
+            input_hash = self.batches_hashes.pop(committed_row, None)
+            for last_row in [last_row for last_row in self.batches_hashes if last_row < committed_row]:
+                del self.batches_hashes[last_row]
+        if input_hash is None:
+            return
+        self.checkpoints.save(self.checkpoint_key, {
+            "first_row": self.first_input_row,
+            "input_rows": max(committed_row - self.first_input_row + 1, 0),
+            "input_hash": input_hash
+        })
+
+    def get_ranges_writer(self, first_row):
+        return WorksheetRangesWriter(
+            self.worksheet, self.value_input_option, first_row=first_row, number_of_workers=self.number_of_workers,
+            truncate=self.write_mode == "overwrite", batch_sizer=self.batch_sizer, on_commit=self.save_checkpoint
+        )
+
+    def write_dataframe(self, dataframe):
+        # Each chunk is serialized with column operations, its rows being sized on a sample
+        rows = serialize_dataframe(dataframe, self.value_input_option)
+        self.write_rows(rows, estimate_rows_bytes(rows))
+
+    def write_rows(self, rows, row_bytes=None):
+        """
+        row_bytes is the average size of the rows, each row is measured if not set
+        """
+        if self.upsert_writer is not None:
+            self.upsert_writer.write_rows(rows)
+            return
+        if self.rows_to_skip > 0:
+            # Rows written by the failed run are not sent again
+            skipped_rows = min(self.rows_to_skip, len(rows))
+            update_hash(self.input_hash, rows[:skipped_rows])
+            rows = rows[skipped_rows:]
+            self.rows_to_skip -= skipped_rows
+        for values in rows:
+            if self.checkpoints is not None:
+                update_hash(self.input_hash, [values])
+            self.batch.append(values)
+            self.batch_bytes += estimate_row_bytes(values) if row_bytes is None else row_bytes
+            self.batch_cells += len(values)
+            if self.batch_sizer.is_full(len(self.batch), self.batch_bytes, self.batch_cells):
+                # API calls are throttled and retried by the session, this legacy delay only adds up to it
+                if self.insertion_delay > 0:
+                    time.sleep(0.01 * self.insertion_delay)
+                self.send_batch()
+
+    def send_batch(self):
+        if self.ranges_writer is None:
+            # The first batch is appended to find where the existing table ends
+            start = time.monotonic()
+            response = self.worksheet.append_rows(self.batch, self.value_input_option)
+            self.batch_sizer.record_batch(get_api_latency(self.worksheet, time.monotonic() - start))
+            last_row = get_last_row_of_range(response.get("updates", {}).get("updatedRange"))
+            self.first_input_row = last_row - len(self.batch) + 1
+            self.record_batch_hash(last_row)
+            self.save_checkpoint(last_row)
+            self.ranges_writer = self.get_ranges_writer(last_row + 1)
+        else:
+            # The hash is recorded before sending, as the batch may be acknowledged right away
+            self.record_batch_hash(self.ranges_writer.next_row + len(self.batch) - 1)
+            self.ranges_writer.write_rows(self.batch)
+        self.batch = []
+        self.batch_bytes = 0
+        self.batch_cells = 0
+
+    def record_batch_hash(self, last_row):
+        if self.checkpoints is None:
+            return
+        with self.hashes_lock:
+            self.batches_hashes[last_row] = self.input_hash.hexdigest()
+
+    def close(self):
+        if self.batch:
+            self.send_batch()
+        if self.ranges_writer is not None:
+            self.ranges_writer.close()
+        if self.upsert_writer is not None:
+            self.upsert_writer.close()
+        if self.checkpoints is not None:
+            self.checkpoints.delete(self.checkpoint_key)
@@ -0,0 +1,240 @@
+import datetime
+import re
+from googlesheets import get_a1_range
+from googlesheets_common import DSSConstants
+from googlesheets_writer import estimate_row_bytes
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+SPREADSHEET_EPOCH = datetime.datetime(1899, 12, 30)
+GSPREAD_DATE_REGEX = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+NUMBER_REGEX = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+# Beyond 2^53, floats no longer hold every integer
+MAX_EXACT_INTEGER = 2 ** 53
+
+
+def normalize_number(value):
+    # Integers are compared exactly, and so are floats, whole ones being written like the integers the API returns for them
+    if isinstance(value, int):
+        return "{}".format(value)
+    if value.is_integer() and abs(value) < MAX_EXACT_INTEGER:
+        return "{}".format(int(value))
+    return repr(value)
+
+
+def normalize_date(value):
+    """
+    Returns the number of seconds since the spreadsheets epoch of a date, given as a serial number or
+    as a string formatted for Google Sheets to parse it, as the serial numbers computed by Google
+    and by the plugin may differ in their last digits
+    """
+    if isinstance(value, str):
+        date = datetime.datetime.strptime(value, DSSConstants.GSPREAD_DATE_FORMAT)
+        return "{}".format(int((date - SPREADSHEET_EPOCH).total_seconds()))
+    return "{}".format(int(round(value * 86400)))
+
+
+def normalize_cell(value, value_input_option="USER_ENTERED", is_date=False):
+    """
+    Returns a string comparable between a value read from the sheet with UNFORMATTED_VALUE
+    and the value written to it, which Google parses when value_input_option is USER_ENTERED.
+    Dates are only compared to the second in the columns written with dates (is_date).
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return normalize_date(value) if is_date else normalize_number(value)
+    value = "{}".format(value)
+    if value_input_option != "USER_ENTERED" or value == "":
+        return value
+    if value.upper() in ["TRUE", "FALSE"]:
+        return value.upper()
+    if is_date and GSPREAD_DATE_REGEX.match(value):
+        return normalize_date(value)
+    if NUMBER_REGEX.match(value):
+        try:
+            return normalize_number(int(value))
+        except ValueError:
+            return normalize_number(float(value))
+    return value
+
+
+def normalize_row(row, number_of_columns, value_input_option="USER_ENTERED", dates_indexes=()):
+    normalized_row = [
+        normalize_cell(value, value_input_option, index in dates_indexes) for index, value in enumerate(row[:number_of_columns])
+    ]
+    return tuple(normalized_row + [""] * (number_of_columns - len(normalized_row)))
+
+
+def get_dates_indexes(rows, value_input_option="USER_ENTERED"):
+    """
+    Indexes of the columns written with dates formatted for Google Sheets to parse them
+    """
+    if value_input_option != "USER_ENTERED":
+        return set()
+    dates_indexes = set()
+    for row in rows:
+        for index, value in enumerate(row):
+            if index not in dates_indexes and isinstance(value, str) and GSPREAD_DATE_REGEX.match(value):
+                dates_indexes.add(index)
+    return dates_indexes
+
+
+def get_deletion_ranges(rows_numbers):
+    """
+    Groups rows numbers in (first row, last row) ranges, last ones first so that
+    deleting a range does not move the ones still to delete
+    """
+    ranges = []
+    for row_number in sorted(rows_numbers):
+        if ranges and ranges[-1][1] == row_number - 1:
+            ranges[-1][1] = row_number
+        else:
+            ranges.append([row_number, row_number])
+    return [tuple(deletion_range) for deletion_range in reversed(ranges)]
+
+
+def get_update_ranges(updated_rows):
+    """
+    Groups a {row number: row} dict in (first row, rows) ranges of consecutive rows
+    """
+    ranges = []
+    for row_number in sorted(updated_rows):
+        if ranges and ranges[-1][0] + len(ranges[-1][1]) == row_number:
+            ranges[-1][1].append(updated_rows[row_number])
+        else:
+            ranges.append((row_number, [updated_rows[row_number]]))
+    return ranges
+
+
+class WorksheetUpsertWriter(object):
+    """
+    Makes a worksheet with a header row match the written rows, rows being matched on the key columns.
+    The worksheet is read once, then only changed rows are updated and new rows appended,
+    all in a single values.batchUpdate when it fits in a request, and rows whose keys were
+    not written are deleted with a single batchUpdate. If the header does not match the columns,
+    the whole sheet is rewritten this way.
+    Rows are compared on close, once the columns holding dates are known from the written rows.
+    """
+
+    def __init__(self, session, worksheet, columns, keys, value_input_option="USER_ENTERED"):
+        missing_keys = [key for key in keys if key not in columns]
+        if not keys or missing_keys:
+            raise ValueError("The upsert key columns {} are not in the dataset columns {}".format(missing_keys or keys, columns))
+        self.session = session
+        self.worksheet = worksheet
+        self.columns = list(columns)
+        self.number_of_columns = len(self.columns)
+        self.keys_indexes = [self.columns.index(key) for key in keys]
+        self.value_input_option = value_input_option
+        self.sheet_rows = []
+        self.written_rows = []
+        self.header_matches = False
+        self.last_row = 1
+        self.load_worksheet()
+
+    def load_worksheet(self):
+        rows = self.session.iter_worksheet_rows(self.worksheet, value_render_option="UNFORMATTED_VALUE")
+        header = next(rows, None)
+        self.header_matches = header is not None and normalize_row(header, len(header), "RAW") == tuple(self.columns)
+        if not self.header_matches:
+            logger.info("The header of sheet '{}' does not match the columns, all the rows will be rewritten".format(self.worksheet.title))
+        for row_number, row in enumerate(rows, start=2):
+            self.last_row = row_number
+            if self.header_matches:
+                self.sheet_rows.append((row_number, row))
+
+    def write_row(self, row):
+        # Null values would leave the previous content of their cells
+        row = ["" if value is None else value for value in row[:self.number_of_columns]]
+        row += [""] * (self.number_of_columns - len(row))
+        self.written_rows.append(row)
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write_row(row)
+
+    def get_changes(self):
+        """
+        Returns ({row number: row} of the rows to update, rows to append, numbers of the rows to delete)
+        """
+        updated_rows = {} if self.header_matches else {1: self.columns}
+        appended_rows = []
+        dates_indexes = get_dates_indexes(self.written_rows, self.value_input_option)
+        # Values of the sheet are normalized as written ones, in case some cells are formatted as plain text
+        rows_numbers = {}
+        normalized_rows = {}
+        deleted_rows_numbers = [] if self.header_matches else list(range(2, self.last_row + 1))
+        for row_number, row in self.sheet_rows:
+            normalized_row = normalize_row(row, self.number_of_columns, self.value_input_option, dates_indexes)
+            key = tuple(normalized_row[key_index] for key_index in self.keys_indexes)
+            if key in rows_numbers:
+                deleted_rows_numbers.append(row_number)
+                continue
+            rows_numbers[key] = row_number
+            normalized_rows[key] = normalized_row
+        written_keys = set()
+        for row in self.written_rows:
+            normalized_row = normalize_row(row, self.number_of_columns, self.value_input_option, dates_indexes)
+            key = tuple(normalized_row[key_index] for key_index in self.keys_indexes)
+            if key in written_keys or key not in rows_numbers:
+                appended_rows.append(row)
+            elif normalized_row != normalized_rows[key]:
+                updated_rows[rows_numbers[key]] = row
+            written_keys.add(key)
+        deleted_rows_numbers += [row_number for key, row_number in rows_numbers.items() if key not in written_keys]
+        return updated_rows, appended_rows, deleted_rows_numbers
+
+    def close(self):
+        updated_rows, appended_rows, deleted_rows_numbers = self.get_changes()
+        number_of_updated_rows = len(updated_rows)
+        for row in appended_rows:
+            self.last_row += 1
+            updated_rows[self.last_row] = row
+        if self.last_row > self.worksheet.row_count or self.number_of_columns > self.worksheet.col_count:
+            self.worksheet.resize(rows=max(self.last_row, self.worksheet.row_count), cols=max(self.number_of_columns, self.worksheet.col_count))
+        self.send_updates(updated_rows)
+        if deleted_rows_numbers:
+            self.worksheet.spreadsheet.batch_update({
+                "requests": [{
+                    "deleteDimension": {
+                        "range": {
+                            "sheetId": self.worksheet.id,
+                            "dimension": "ROWS",
+                            "startIndex": first_row - 1,
+                            "endIndex": last_row
+                        }
+                    }
+                } for first_row, last_row in get_deletion_ranges(deleted_rows_numbers)]
+            }, is_idempotent=False)
+        logger.info("Sheet '{}' upserted: {} rows updated, {} rows appended, {} rows deleted".format(
+            self.worksheet.title, number_of_updated_rows, len(appended_rows), len(deleted_rows_numbers)
+        ))
+
+    def send_updates(self, updated_rows):
+        # Ranges go in a single request, unless they exceed the request size limit
+        data = []
+        data_bytes = 0
+        for first_row, rows in get_update_ranges(updated_rows):
+            range_bytes = sum(estimate_row_bytes(row) for row in rows)
+            if data and data_bytes + range_bytes > DSSConstants.MAX_BYTES_PER_WRITE_REQUEST:
+                self.send_ranges(data)
+                data = []
+                data_bytes = 0
+            data.append({
+                "range": get_a1_range(self.worksheet.title, first_row, first_row + len(rows) - 1, self.number_of_columns),
+                "values": rows
+            })
+            data_bytes += range_bytes
+        if data:
+            self.send_ranges(data)
+
+    def send_ranges(self, data):
+        self.worksheet.spreadsheet.values_batch_update(body={
+            "valueInputOption": self.value_input_option,
+            "data": data
+        })
@@ -0,0 +1,227 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import gspread
+from googlesheets import get_a1_range
+from googlesheets_common import DSSConstants
+from safe_logger import SafeLogger
+
+
+logger = SafeLogger("googlesheets plugin", ["credentials", "access_token"])
+
+
+def estimate_row_bytes(row):
+    # Size of the row once JSON encoded, counting quotes and separator for each cell
+    return sum(len("{}".format(value)) for value in row) + 3 * len(row) + 2
+
+
+def is_payload_too_large(error):
+    if not isinstance(error, gspread.exceptions.APIError) or getattr(error, "response", None) is None:
+        return False
+    if error.response.status_code == 413:
+        return True
+    return error.response.status_code == 400 and "payload size" in "{}".format(error).lower()
+
+
+def get_api_latency(worksheet, elapsed_time):
+    """
+    Returns the latency of the last request sent for worksheet by the calling thread, as measured by the client,
+    or elapsed_time if the client does not measure it. Waiting for the quota is not a sign that batches are too large.
+    """
+    get_last_latency = getattr(getattr(worksheet.spreadsheet, "client", None), "get_last_latency", None)
+    latency = get_last_latency() if get_last_latency else None
+    return elapsed_time if latency is None else latency
+
+
+class BatchSizer(object):
+    """
+    Decides when a batch of rows is worth a write request.
+    Batches are always cut before exceeding Google's request size limits. Otherwise, they are cut
+    every batch_size rows or, when adaptive, once they reach a target size in bytes. The target
+    starts at the size of the first batch_size rows, doubles while requests are answered quickly,
+    and is halved when they are slow or fail. Latencies should not include the time spent waiting
+    for the quota, as smaller batches would only mean more requests. Batches refused
+    for their size also lower the limit they can grow back to.
+    """
+
+    def __init__(self, batch_size, adaptive=True):
+        self.batch_size = max(batch_size, 1)
+        self.adaptive = adaptive
+        self.target_bytes = None
+        self.max_bytes = DSSConstants.MAX_BYTES_PER_WRITE_REQUEST
+        self.lock = threading.Lock()
+
+    def is_full(self, number_of_rows, number_of_bytes, number_of_cells):
+        if number_of_bytes >= self.max_bytes or number_of_cells >= DSSConstants.MAX_CELLS_PER_WRITE_REQUEST:
+            return True
+        if self.adaptive:
+            with self.lock:
+                if self.target_bytes is None:
+                    if number_of_rows >= self.batch_size:
+                        self.target_bytes = max(number_of_bytes, DSSConstants.MIN_BYTES_PER_WRITE_REQUEST)
+                        return True
+                    return False
+                return number_of_bytes >= self.target_bytes
+        return number_of_rows >= self.batch_size
+
+    def record_batch(self, latency):
+        if not self.adaptive:
+            return
+        with self.lock:
+            if self.target_bytes is None:
+                return
+            if latency < DSSConstants.FAST_WRITE_LATENCY:
+                self.target_bytes = min(2 * self.target_bytes, self.max_bytes)
+            elif latency > DSSConstants.SLOW_WRITE_LATENCY:
+                self.shrink()
+
+    def record_failure(self, refused_bytes=None):
+        """
+        refused_bytes is the size of a batch refused for being too large, if that is why it failed
+        """
+        if not self.adaptive:
+            return
+        with self.lock:
+            if self.target_bytes is None:
+                return
+            if refused_bytes:
+                # Batches will not grow back to a size the API refused
+                self.max_bytes = max(min(self.max_bytes, refused_bytes // 2), DSSConstants.MIN_BYTES_PER_WRITE_REQUEST)
+            self.shrink()
+
+    def shrink(self):
+        self.target_bytes = max(min(self.target_bytes // 2, self.max_bytes), DSSConstants.MIN_BYTES_PER_WRITE_REQUEST)
+        logger.info("Write requests are slow or failing, batches are reduced to {} bytes".format(self.target_bytes))
+
+
+class WorksheetRangesWriter(object):
+    """
+    Writes batches of rows to consecutive row ranges of a worksheet, with several batches
+    in flight at once on a small thread pool. Each batch is sent to its own explicit range,
+    so rows end up in order whatever the order in which the requests complete.
+    With truncate, the worksheet is resized to the written rows and columns on close,
+    otherwise it is only shrunk back to its initial number of rows.
+    Batches too large for the API are split in two and sent again, other failed batches are
+    reported with their row range once all the batches in flight are done.
+    The latency of each request is reported to batch_sizer, if any, and on_commit, if any, is called
+    with the last row written whenever all the rows from first_row up to it are written.
+    """
+
+    def __init__(self, worksheet, value_input_option, first_row=1, number_of_workers=DSSConstants.DEFAULT_UPLOAD_WORKERS, truncate=False,
+                 batch_sizer=None, on_commit=None):
+        self.worksheet = worksheet
+        self.batch_sizer = batch_sizer
+        self.value_input_option = value_input_option
+        self.next_row = first_row
+        self.truncate = truncate
+        self.initial_grid_rows = worksheet.row_count
+        self.grid_rows = worksheet.row_count
+        self.grid_columns = worksheet.col_count
+        self.written_columns = 0
+        self.number_of_workers = max(number_of_workers, 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.number_of_workers)
+        self.pending_futures = collections.deque()
+        self.failures = []
+        self.on_commit = on_commit
+        self.committed_row = first_row - 1
+        self.written_batches = {}
+        self.commit_lock = threading.Lock()
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        first_row = self.next_row
+        last_row = first_row + len(rows) - 1
+        number_of_columns = max(len(row) for row in rows) or 1
+        self.ensure_grid_size(last_row, number_of_columns)
+        # Bound the number of batches held in memory while waiting for the API
+        while len(self.pending_futures) >= 2 * self.number_of_workers:
+            self.wait_for_batch(self.pending_futures.popleft())
+        if self.failures:
+            self.raise_failures()
+        self.pending_futures.append(
+            self.executor.submit(self.write_batch, first_row, last_row, number_of_columns, rows)
+        )
+        self.next_row = last_row + 1
+        self.written_columns = max(self.written_columns, number_of_columns)
+
+    def wait_for_batch(self, future):
+        try:
+            future.result()
+        except Exception as error:
+            self.failures.append(error)
+
+    def raise_failures(self):
+        # Batches already sent are completed, so that the report covers all of them
+        while self.pending_futures:
+            self.wait_for_batch(self.pending_futures.popleft())
+        self.executor.shutdown(wait=True)
+        raise Exception("{} batch(es) could not be written to sheet '{}':\n{}".format(
+            len(self.failures), self.worksheet.title, "\n".join("{}".format(failure) for failure in self.failures)
+        ))
+
+    def ensure_grid_size(self, last_row, number_of_columns):
+        # values.update does not grow the grid, so it is grown geometrically beforehand, within Google's cells limit.
+        # With truncate, columns are narrowed to the written ones right away, so that they do not eat up that limit
+        if self.truncate:
+            grid_columns = max(self.written_columns, number_of_columns)
+        else:
+            grid_columns = max(self.grid_columns, number_of_columns)
+        if last_row <= self.grid_rows and grid_columns == self.grid_columns:
+            return
+        if last_row > self.grid_rows:
+            max_grid_rows = DSSConstants.MAX_CELLS_PER_DOCUMENT // grid_columns
+            self.grid_rows = max(last_row, min(2 * self.grid_rows, max_grid_rows))
+        self.grid_columns = grid_columns
+        self.worksheet.resize(rows=self.grid_rows, cols=self.grid_columns)
+
+    def write_batch(self, first_row, last_row, number_of_columns, rows):
+        self.update_range(first_row, last_row, number_of_columns, rows)
+        # Batches complete in any order, rows are only committed once the ones before them are written too
+        with self.commit_lock:
+            self.written_batches[first_row] = last_row
+            committed_row = self.committed_row
+            while committed_row + 1 in self.written_batches:
+                committed_row = self.written_batches.pop(committed_row + 1)
+            if committed_row != self.committed_row:
+                self.committed_row = committed_row
+                if self.on_commit:
+                    self.on_commit(committed_row)
+
+    def update_range(self, first_row, last_row, number_of_columns, rows):
+        a1_range = get_a1_range(self.worksheet.title, first_row, last_row, number_of_columns)
+        start = time.monotonic()
+        try:
+            self.worksheet.spreadsheet.values_update(
+                a1_range,
+                params={"valueInputOption": self.value_input_option},
+                body={"values": rows}
+            )
+            if self.batch_sizer:
+                self.batch_sizer.record_batch(get_api_latency(self.worksheet, time.monotonic() - start))
+        except Exception as error:
+            payload_too_large = is_payload_too_large(error)
+            if self.batch_sizer:
+                self.batch_sizer.record_failure(sum(estimate_row_bytes(row) for row in rows) if payload_too_large else None)
+            if payload_too_large and len(rows) > 1:
+                logger.warning("Rows {} to {} are too large for a single request, splitting them".format(first_row, last_row))
+                middle = len(rows) // 2
+                self.update_range(first_row, first_row + middle - 1, number_of_columns, rows[:middle])
+                self.update_range(first_row + middle, last_row, number_of_columns, rows[middle:])
+                return
+            logger.error("Rows {} to {} could not be written: {}".format(first_row, last_row, error))
+            raise Exception("Rows {} to {}: {}".format(first_row, last_row, error))
+
+    def close(self):
+        while self.pending_futures:
+            self.wait_for_batch(self.pending_futures.popleft())
+        if self.failures:
+            self.raise_failures()
+        self.executor.shutdown(wait=True)
+        last_written_row = self.next_row - 1
+        if self.truncate and last_written_row > 0:
+            if self.grid_rows != last_written_row or self.grid_columns != self.written_columns:
+                self.worksheet.resize(rows=last_written_row, cols=self.written_columns)
+        elif self.grid_rows > max(last_written_row, self.initial_grid_rows):
+            self.worksheet.resize(rows=max(last_written_row, self.initial_grid_rows), cols=self.grid_columns)
@@ -1,6 +1,8 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import dataiku
 from dataiku.runnables import Runnable, ResultTable
-from googlesheets_common import DSSConstants, extract_credentials, get_unique_slugs, get_unique_names
+from googlesheets_common import DSSConstants, extract_credentials, get_unique_names, pad_rows, UniqueNamesAllocator, slugify_name, get_number_of_workers
 from googlesheets import GoogleSheetsSession
 from safe_logger import SafeLogger
 
@@ -30,6 +32,7 @@ class GoogleSheetsToDatasetsImporter(Runnable):
         self.project = dss_client.get_project(project_key)
         self.project_datasets = list_project_datasets_names(self.project)
         self.creation_mode = self.config.get("creation_mode", "create-new")
+        self.import_workers = get_number_of_workers(self.config, "import_workers", DSSConstants.DEFAULT_IMPORT_WORKERS)
         self.worksheets = self.session.get_spreadsheets(self.doc_id)
         if not self.tabs_ids:
             for worksheet in self.worksheets:
@@ -62,63 +65,82 @@ class GoogleSheetsToDatasetsImporter(Runnable):
                 target_zone = project_flow.create_zone(spreadsheet_title)
 
         if self.creation_mode == "create-new":
-            worksheets_titles = self.project_datasets.copy()
+            existing_titles = self.project_datasets
         else:
-            worksheets_titles = []
-        index = 0
-        for worksheet in self.worksheets:
-            worksheet_title = worksheet.title
-            if worksheet_title in self.tabs_ids:
-                index += 1
-                progress_callback(index)
-                dataset = None
-                worksheets_titles.append("{}_{}".format(spreadsheet_title, worksheet_title))
-                worksheets_titles = get_unique_slugs(worksheets_titles)
-                unique_worksheet_title = worksheets_titles[-1]
-
-                rows = []
-                if not self.is_dry_run:
-                    rows = worksheet.get_all_values()
-                if not rows:
-                    continue
-                dataset_title = unique_worksheet_title
-                if dataset_title in self.project_datasets:
-                    if self.creation_mode == "skip":
-                        result_table.add_record([self._get_text("skipping").format(dataset_title=dataset_title)])
-                        continue
-                    result_table.add_record([self._get_text("updating").format(dataset_title=dataset_title)])
-                    if not self.is_dry_run:
-                        dataset = self.project.get_dataset(dataset_title)
-                else:
-                    params = {
-                        "connection": "filesystem_folders",
-                        "path": "{}/{}".format(self.project_key, dataset_title)
-                    }
-                    result_table.add_record([self._get_text("adding").format(dataset_title=dataset_title)])
-                    if not self.is_dry_run:
-                        dataset = self.project.create_dataset(
-                            dataset_title, "Filesystem", params=params, formatType='csv',
-                            formatParams=DSSConstants.DEFAULT_DATASET_FORMAT
-                        )
-                    if target_zone and dataset:
-                        dataset.move_to_zone(target_zone)
-                if not self.is_dry_run:
-                    set_dataset_as_managed(dataset)
-                    output_dataset = dataiku.Dataset(dataset_title)
-                    column_names = get_unique_names(rows[0])
-                    schema = []
-                    for column_name in column_names:
-                        schema.append({"name": column_name, "type": "string"})
-                    output_dataset.write_schema(schema)
-                    data_rows = rows[1:]
-                    if not self.is_dry_run:
-                        with output_dataset.get_writer() as writer:
-                            for row in data_rows:
-                                writer.write_row_array(row)
+            existing_titles = []
+        titles_allocator = UniqueNamesAllocator(normalize=slugify_name, existing_names=existing_titles)
+        selected_worksheets = [worksheet for worksheet in self.worksheets if worksheet.title in self.tabs_ids]
+        datasets_titles = []
+        for worksheet in selected_worksheets:
+            datasets_titles.append(titles_allocator.allocate("{}_{}".format(spreadsheet_title, worksheet.title)))
+
+        # Tabs are fetched and written concurrently, API calls being throttled by the shared session,
+        # while changes to the project's datasets are made one at a time
+        creation_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=self.import_workers) as executor:
+            futures = [
+                executor.submit(self.import_worksheet, worksheet, dataset_title, target_zone, creation_lock)
+                for worksheet, dataset_title in zip(selected_worksheets, datasets_titles)
+            ]
+            completed_imports = 0
+            for _ in as_completed(futures):
+                completed_imports += 1
+                progress_callback(completed_imports)
+            for future in futures:
+                for record in future.result():
+                    result_table.add_record(record)
         if self.is_dry_run:
             result_table.add_record(["⚠️ You have to un-check the 'Dry run' box to implement these actions."])
+        self.session.log_metrics("Import macro", self.config.get("metrics_file"))
         return result_table
 
+    def import_worksheet(self, worksheet, dataset_title, target_zone, creation_lock):
+        """
+        Imports one worksheet in the dataset_title dataset, and returns the records describing the actions taken.
+        """
+        records = []
+        dataset = None
+        rows = []
+        if not self.is_dry_run:
+            rows = pad_rows(list(self.session.iter_worksheet_rows(worksheet)))
+        if not rows:
+            return records
+        with creation_lock:
+            if dataset_title in self.project_datasets:
+                if self.creation_mode == "skip":
+                    records.append([self._get_text("skipping").format(dataset_title=dataset_title)])
+                    return records
+                records.append([self._get_text("updating").format(dataset_title=dataset_title)])
+                if not self.is_dry_run:
+                    dataset = self.project.get_dataset(dataset_title)
+            else:
+                params = {
+                    "connection": "filesystem_folders",
+                    "path": "{}/{}".format(self.project_key, dataset_title)
+                }
+                records.append([self._get_text("adding").format(dataset_title=dataset_title)])
+                if not self.is_dry_run:
+                    dataset = self.project.create_dataset(
+                        dataset_title, "Filesystem", params=params, formatType='csv',
+                        formatParams=DSSConstants.DEFAULT_DATASET_FORMAT
+                    )
+                if target_zone and dataset:
+                    dataset.move_to_zone(target_zone)
+            if not self.is_dry_run:
+                set_dataset_as_managed(dataset)
+        if not self.is_dry_run:
+            output_dataset = dataiku.Dataset(dataset_title)
+            column_names = get_unique_names(rows[0])
+            schema = []
+            for column_name in column_names:
+                schema.append({"name": column_name, "type": "string"})
+            output_dataset.write_schema(schema)
+            data_rows = rows[1:]
+            with output_dataset.get_writer() as writer:
+                for row in data_rows:
+                    writer.write_row_array(row)
+        return records
+
     def _get_text(self, text_description):
         DRY_RUN_TEXTS = {
             "actions": "Actions to be taken",
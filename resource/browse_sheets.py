@@ -1,5 +1,13 @@
-from googlesheets_common import extract_credentials
+import os
+from googlesheets_common import DSSConstants, extract_credentials
 from googlesheets import GoogleSheetsSession
+from googlesheets_cache import FileCache, get_hash
+
+
+# Sheets lists are kept a few minutes, so that the selector does not hit the API each time it is opened
+tabs_titles_cache = FileCache("tabs_titles", ttl=DSSConstants.TABS_TITLES_CACHE_TTL)
+# Last state of the refresh box seen for each dataset, recipe or macro settings
+refresh_states = FileCache("refresh_states", ttl=DSSConstants.REFRESH_STATES_TTL)
 
 
 def build_select_choices(choices=None):
@@ -18,6 +26,32 @@ def build_select_choices(choices=None):
             })
 
 
+def get_config_key(root_model, inputs):
+    """
+    Returns a key for the settings being edited, made of the project, the inputs and the settings other than the
+    sheets selection and the refresh box. DSS does not tell which dataset or recipe is edited, so settings changed
+    in between are seen as new ones, whose refresh box is only taken into account once toggled.
+    """
+    settings = sorted(
+        (name, "{}".format(value)) for name, value in root_model.items() if name not in ["tabs_ids", "refresh_tabs_ids"]
+    )
+    return get_hash(os.environ.get("DKU_CURRENT_PROJECT_KEY"), inputs, settings)
+
+
+def is_refresh_requested(root_model, inputs):
+    """
+    The refresh box is saved with the settings, so the list is reloaded once each time it is toggled,
+    and not on every call while it stays ticked.
+    """
+    config_key = get_config_key(root_model, inputs)
+    refresh_tabs_ids = bool(root_model.get("refresh_tabs_ids"))
+    last_refresh_tabs_ids = refresh_states.get(config_key)
+    if last_refresh_tabs_ids == refresh_tabs_ids:
+        return False
+    refresh_states.set(config_key, refresh_tabs_ids)
+    return last_refresh_tabs_ids is not None
+
+
 def do(payload, config, plugin_config, inputs):
     if "config" in config:
         config = config.get("config")
@@ -32,14 +66,20 @@ def do(payload, config, plugin_config, inputs):
     if not doc_id:
         return build_select_choices("Please set the document id")
     if parameter_name == "tabs_ids":
-        try:
-            session = GoogleSheetsSession(credentials, credentials_type)
-            worksheets = session.get_spreadsheets(doc_id)
-        except Exception as error_message:
-            return build_select_choices("{}".format(error_message))
+        cache_key = get_hash(credentials_type, credentials, doc_id)
+        worksheets_titles = None
+        if not is_refresh_requested(root_model, inputs):
+            worksheets_titles = tabs_titles_cache.get(cache_key)
+        if worksheets_titles is None:
+            try:
+                session = GoogleSheetsSession(credentials, credentials_type)
+                worksheets = session.get_spreadsheets(doc_id)
+            except Exception as error_message:
+                return build_select_choices("{}".format(error_message))
+            worksheets_titles = ["{}".format(worksheet.title) for worksheet in worksheets]
+            tabs_titles_cache.set(cache_key, worksheets_titles)
         choices = []
-        for worksheet in worksheets:
-            worksheet_title = "{}".format(worksheet.title)
+        for worksheet_title in worksheets_titles:
             choices.append({
                 "label": worksheet_title,
                 "value": worksheet_title
@@ -0,0 +1,342 @@
+"""
+End to end benchmark of the plugin's Google Sheets traffic, run offline against fake_sheets_server.py.
+
+    PYTHONPATH=python-lib python3 tests/python/benchmark/api_benchmark.py --cells 10000 100000 1000000 --latency 0.05
+
+Scenarios:
+- connector_read: MyConnector.generate_rows over a whole sheet
+- connector_write: MyCustomDatasetWriter in OVERWRITE mode
+- recipe_append: the append recipe's WorksheetUploader (first batch appended, next ones written to explicit ranges)
+- macro_import: the import macro's parallel fetch of all the tabs of a document
+The connector scenarios need the DSS python libraries (dataiku.connector) on the PYTHONPATH, and are skipped otherwise.
+For each scenario and size, throughput, peak traced memory, and requests count and server side latency
+per API operation are reported. --output also saves them as JSON.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+import pandas
+from googlesheets import GoogleSheetsSession
+from googlesheets_checkpoint import CheckpointStore
+from googlesheets_common import DSSConstants, pad_rows
+from googlesheets_uploader import WorksheetUploader
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_FOLDER = os.path.abspath(os.path.join(BENCHMARK_FOLDER, "..", "..", ".."))
+SERVER_SCRIPT = os.path.join(BENCHMARK_FOLDER, "fake_sheets_server.py")
+CONNECTOR_SCRIPT = os.path.join(PLUGIN_FOLDER, "python-connectors", "googlesheets-sheet", "connector.py")
+GOOGLE_APIS_ROOTS = ["https://sheets.googleapis.com", "https://www.googleapis.com"]
+ACCESS_TOKEN = "fake-access-token"
+TAB_TITLE = "Sheet1"
+
+
+class FakeServerAdapter(HTTPAdapter):
+    """
+    Transport adapter sending the requests meant for Google APIs to the fake server instead.
+    """
+
+    def __init__(self, base_url):
+        HTTPAdapter.__init__(self)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        for root in GOOGLE_APIS_ROOTS:
+            if request.url.startswith(root):
+                request.url = self.base_url + request.url[len(root):]
+        return HTTPAdapter.send(self, request, **kwargs)
+
+
+class FakeSheetsServer(object):
+
+    def __init__(self, latency=0, quota_error_every=0, max_payload_bytes=10485760):
+        self.process = subprocess.Popen(
+            [
+                sys.executable, SERVER_SCRIPT,
+                "--latency", str(latency),
+                "--quota-error-every", str(quota_error_every),
+                "--max-payload-bytes", str(max_payload_bytes)
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        )
+        port = int(self.process.stdout.readline())
+        self.base_url = "http://127.0.0.1:{}".format(port)
+        self.control_session = requests.Session()
+
+    def control(self, path, payload=None):
+        if payload is None:
+            response = self.control_session.get(self.base_url + path)
+        else:
+            response = self.control_session.post(self.base_url + path, json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    def generate(self, document_id, tabs=1, rows=0, columns=1, decorations=0):
+        self.control("/_generate", {
+            "document_id": document_id, "tabs": tabs, "rows": rows, "columns": columns, "decorations": decorations
+        })
+
+    def reset(self):
+        self.control("/_reset", {})
+
+    def get_stats(self):
+        return self.control("/_stats")
+
+    def redirect(self, session):
+        # Authorized clients are shared by all the sessions using the same credentials, including the connector's
+        adapter = FakeServerAdapter(self.base_url)
+        for root in GOOGLE_APIS_ROOTS:
+            session.client.session.mount(root, adapter)
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def load_connector_module():
+    try:
+        import dataiku.connector  # noqa: F401
+    except ImportError:
+        return None
+    specification = importlib.util.spec_from_file_location("googlesheets_connector", CONNECTOR_SCRIPT)
+    module = importlib.util.module_from_spec(specification)
+    specification.loader.exec_module(module)
+    return module
+
+
+def get_connector_config(document_id, requests_per_minute):
+    return {
+        "auth_type": "single-sign-on",
+        "oauth_credentials": {"access_token": ACCESS_TOKEN},
+        "doc_id": document_id,
+        "tabs_ids": [TAB_TITLE],
+        "result_format": "first-row-header",
+        "write_format": "RAW",
+        "requests_per_minute": requests_per_minute
+    }
+
+
+def iter_generated_rows(rows, columns, first_row=0):
+    for row in range(first_row, first_row + rows):
+        yield ["r{}c{}".format(row, column) for column in range(columns)]
+
+
+def iter_generated_dataframes(rows, columns):
+    # Chunks as the recipe reads them from its input dataset
+    for start in range(0, rows, DSSConstants.INPUT_CHUNK_SIZE):
+        yield pandas.DataFrame(
+            list(iter_generated_rows(min(DSSConstants.INPUT_CHUNK_SIZE, rows - start), columns, start)),
+            columns=["Column {}".format(column) for column in range(columns)]
+        )
+
+
+def count_sheet_rows(session, document_id):
+    worksheet = session.get_spreadsheet(document_id, TAB_TITLE)
+    return sum(1 for _ in session.iter_worksheet_rows(worksheet))
+
+
+def run_connector_read(context, document_id, rows, columns):
+    context.server.generate(document_id, rows=rows, columns=columns, decorations=context.decorations)
+    connector = context.connector_module.MyConnector(get_connector_config(document_id, context.requests_per_minute))
+    records = 0
+
+    def read():
+        nonlocal records
+        for _ in connector.generate_rows():
+            records += 1
+    result = context.measure(read)
+    assert records == rows, "{} records read out of {}".format(records, rows)
+    return result
+
+
+def run_connector_write(context, document_id, rows, columns):
+    context.server.generate(document_id, rows=0, columns=columns, decorations=context.decorations)
+    connector = context.connector_module.MyConnector(get_connector_config(document_id, context.requests_per_minute))
+    dataset_schema = {"columns": [{"name": "Column {}".format(column), "type": "string"} for column in range(columns)]}
+
+    def write():
+        writer = connector.get_writer(dataset_schema=dataset_schema, write_mode="OVERWRITE")
+        for row in iter_generated_rows(rows, columns):
+            writer.write_row(row)
+        writer.close()
+    result = context.measure(write)
+    assert count_sheet_rows(context.session, document_id) == rows + 1
+    return result
+
+
+def run_recipe_append(context, document_id, rows, columns):
+    context.server.generate(document_id, rows=0, columns=columns, decorations=context.decorations)
+    worksheet = context.session.get_spreadsheet(document_id, TAB_TITLE)
+
+    def upload():
+        # Same upload loop as custom-recipes/googlesheets-append/recipe.py in append mode, checkpoints included
+        uploader = WorksheetUploader(
+            context.session,
+            worksheet,
+            "RAW",
+            ["Column {}".format(column) for column in range(columns)],
+            batch_size=context.batch_size,
+            adaptive_batch_size=context.adaptive_batch_size,
+            number_of_workers=context.workers,
+            checkpoints=CheckpointStore(context.checkpoints_folder),
+            checkpoint_key=document_id,
+            iter_input=lambda: iter_generated_dataframes(rows, columns)
+        )
+        for dataframe in iter_generated_dataframes(rows, columns):
+            uploader.write_dataframe(dataframe)
+        uploader.close()
+    result = context.measure(upload)
+    assert count_sheet_rows(context.session, document_id) == rows + 1
+    return result
+
+
+def run_macro_import(context, document_id, rows, columns):
+    rows_per_tab = max(rows // context.tabs, 1)
+    context.server.generate(document_id, tabs=context.tabs, rows=rows_per_tab, columns=columns, decorations=context.decorations)
+    worksheets = context.session.get_spreadsheets(document_id)
+    imported_rows = []
+
+    def fetch_worksheet(worksheet):
+        # Same fetch as GoogleSheetsToDatasetsImporter.import_worksheet
+        return len(pad_rows(list(context.session.iter_worksheet_rows(worksheet))))
+
+    def import_all():
+        with ThreadPoolExecutor(max_workers=context.workers) as executor:
+            imported_rows.extend(executor.map(fetch_worksheet, worksheets))
+    result = context.measure(import_all)
+    assert imported_rows == [rows_per_tab + 1] * context.tabs
+    return result
+
+
+SCENARIOS = {
+    "connector_read": (run_connector_read, True),
+    "connector_write": (run_connector_write, True),
+    "recipe_append": (run_recipe_append, False),
+    "macro_import": (run_macro_import, False)
+}
+
+
+class BenchmarkContext(object):
+
+    def __init__(self, server, args):
+        self.server = server
+        self.requests_per_minute = args.requests_per_minute
+        self.batch_size = args.batch_size
+        self.adaptive_batch_size = not args.fixed_batch_size
+        self.workers = args.workers
+        self.tabs = args.tabs
+        self.decorations = args.decorations
+        self.trace_memory = not args.skip_memory
+        self.checkpoints_folder = tempfile.mkdtemp()
+        self.session = GoogleSheetsSession(ACCESS_TOKEN, "personnal-account", requests_per_minute=self.requests_per_minute)
+        server.redirect(self.session)
+        self.connector_module = load_connector_module()
+
+    def measure(self, function):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        function()
+        duration = time.perf_counter() - start
+        peak_memory = None
+        if self.trace_memory:
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return {"duration": duration, "peak_memory": peak_memory, "api": self.server.get_stats()}
+
+
+def get_percentile(values, percentile):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * percentile), len(values) - 1)]
+
+
+def summarize(scenario, cells, rows, columns, result):
+    operations = {}
+    for operation, stats in result["api"].items():
+        operations[operation] = {
+            "requests": stats["requests"],
+            "errors": stats["errors"],
+            "request_bytes": stats["request_bytes"],
+            "response_bytes": stats["response_bytes"],
+            "p50_latency": get_percentile(stats["latencies"], 0.5),
+            "p95_latency": get_percentile(stats["latencies"], 0.95)
+        }
+    return {
+        "scenario": scenario,
+        "cells": cells,
+        "rows": rows,
+        "columns": columns,
+        "duration": result["duration"],
+        "cells_per_second": cells / result["duration"] if result["duration"] else None,
+        "peak_memory": result["peak_memory"],
+        "requests": sum(operation["requests"] for operation in operations.values()),
+        "operations": operations
+    }
+
+
+def print_summary(summary):
+    memory = "n/a" if summary["peak_memory"] is None else "{:.1f}MB".format(summary["peak_memory"] / 1048576)
+    print("{scenario} {cells} cells ({rows} x {columns}): {duration:.2f}s, {cells_per_second:.0f} cells/s, peak memory {memory}, {requests} requests".format(
+        memory=memory, **summary
+    ))
+    for operation, stats in sorted(summary["operations"].items()):
+        print("    {}: {} requests ({} errors), {:.1f}kB sent, {:.1f}kB received, p50 {:.0f}ms, p95 {:.0f}ms".format(
+            operation, stats["requests"], stats["errors"], stats["request_bytes"] / 1024.0, stats["response_bytes"] / 1024.0,
+            1000 * stats["p50_latency"], 1000 * stats["p95_latency"]
+        ))
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark of the plugin against a local fake Google Sheets API")
+    parser.add_argument("--cells", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request, in seconds")
+    parser.add_argument("--quota-error-every", type=int, default=0, help="Answer 429 to one request out of n")
+    parser.add_argument("--max-payload-bytes", type=int, default=10485760)
+    parser.add_argument("--requests-per-minute", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=200, help="Rows per batch in recipe_append")
+    parser.add_argument("--fixed-batch-size", action="store_true", help="Disable the adaptive batch size in recipe_append")
+    parser.add_argument("--workers", type=int, default=DSSConstants.DEFAULT_UPLOAD_WORKERS)
+    parser.add_argument("--tabs", type=int, default=4, help="Number of tabs in macro_import")
+    parser.add_argument("--decorations", type=int, default=0, help="Conditional formats and protected ranges per sheet")
+    parser.add_argument("--skip-memory", action="store_true", help="Do not trace memory, which slows Python down")
+    parser.add_argument("--output", help="Path of a JSON file to save the results to")
+    args = parser.parse_args()
+
+    server = FakeSheetsServer(args.latency, args.quota_error_every, args.max_payload_bytes)
+    summaries = []
+    try:
+        context = BenchmarkContext(server, args)
+        for scenario in args.scenarios:
+            run_scenario, needs_connector = SCENARIOS[scenario]
+            if needs_connector and context.connector_module is None:
+                print("{}: skipped, the DSS python libraries are not available".format(scenario))
+                continue
+            for cells in args.cells:
+                rows = max(cells // args.columns, 1)
+                server.reset()
+                result = run_scenario(context, "{}-{}-{}".format(scenario, cells, int(time.time() * 1000)), rows, args.columns)
+                summary = summarize(scenario, rows * args.columns, rows, args.columns, result)
+                print_summary(summary)
+                summaries.append(summary)
+    finally:
+        server.close()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(summaries, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    run()
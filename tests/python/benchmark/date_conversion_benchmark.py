@@ -0,0 +1,52 @@
+"""
+Micro-benchmark of the DSS to Google Sheets date conversion used by USER_ENTERED writes.
+
+    PYTHONPATH=python-lib python3 tests/python/benchmark/date_conversion_benchmark.py
+"""
+import datetime
+import timeit
+from googlesheets_common import DSSConstants, format_date, convert_dss_date, convert_dates_in_rows
+
+NUMBER_OF_ROWS = 100000
+NUMBER_OF_DATE_COLUMNS = 3
+REPEAT = 3
+
+
+def get_rows():
+    start = datetime.datetime(2020, 1, 1)
+    rows = []
+    for index in range(NUMBER_OF_ROWS):
+        date = (start + datetime.timedelta(minutes=17 * index)).strftime("%Y-%m-%dT%H:%M:%S.123Z")
+        rows.append(["label {}".format(index)] + [date] * NUMBER_OF_DATE_COLUMNS)
+    return rows
+
+
+def convert_with_strptime(rows, date_columns):
+    for row in rows:
+        for date_column in date_columns:
+            row[date_column] = format_date(row[date_column], DSSConstants.DSS_DATE_FORMAT, DSSConstants.GSPREAD_DATE_FORMAT)
+    return rows
+
+
+def run():
+    date_columns = list(range(1, NUMBER_OF_DATE_COLUMNS + 1))
+    rows = get_rows()
+    reference = convert_with_strptime([list(row) for row in rows], date_columns)
+    assert convert_dates_in_rows([list(row) for row in rows], date_columns) == reference
+    assert convert_dss_date(rows[0][1]) == reference[0][1]
+
+    number_of_dates = NUMBER_OF_ROWS * NUMBER_OF_DATE_COLUMNS
+    strptime_time = min(timeit.repeat(
+        lambda: convert_with_strptime([list(row) for row in rows], date_columns), number=1, repeat=REPEAT
+    ))
+    fast_time = min(timeit.repeat(
+        lambda: convert_dates_in_rows([list(row) for row in rows], date_columns), number=1, repeat=REPEAT
+    ))
+    print("{} dates".format(number_of_dates))
+    print("strptime / strftime: {:.3f}s ({:.0f} dates/s)".format(strptime_time, number_of_dates / strptime_time))
+    print("convert_dates_in_rows: {:.3f}s ({:.0f} dates/s)".format(fast_time, number_of_dates / fast_time))
+    print("speedup: x{:.1f}".format(strptime_time / fast_time))
+
+
+if __name__ == "__main__":
+    run()
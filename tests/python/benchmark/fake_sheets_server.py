@@ -0,0 +1,504 @@
+"""
+Local stand-in for the Google Sheets v4 and Drive v3 endpoints used by the plugin, for offline benchmarks.
+
+    python3 tests/python/benchmark/fake_sheets_server.py --latency 0.05 --quota-error-every 50
+
+Prints the port it listens on, then serves:
+- GET  /v4/spreadsheets/{id}                          metadata (number formats are never set)
+- POST /v4/spreadsheets/{id}:batchUpdate              updateSheetProperties, appendDimension, deleteDimension, addSheet
+- GET  /v4/spreadsheets/{id}/values/{range}           values.get
+- GET  /v4/spreadsheets/{id}/values:batchGet          values.batchGet
+- PUT  /v4/spreadsheets/{id}/values/{range}           values.update
+- POST /v4/spreadsheets/{id}/values:batchUpdate       values.batchUpdate
+- POST /v4/spreadsheets/{id}/values/{range}:append    values.append
+- POST /v4/spreadsheets/{id}/values/{range}:clear     values.clear
+- GET  /drive/v3/files/{id}                           document version
+and, for the benchmark itself:
+- POST /_generate  {"document_id", "title", "tabs", "rows", "columns", "decorations"}  creates a document,
+  with decorations conditional formats and protected ranges per sheet
+- POST /_reset                                         drops documents and statistics
+- GET  /_stats                                         requests count, bytes and latencies per operation
+Like Google, values beyond the grid and grids beyond 10 million cells per document are rejected, trailing empty rows and cells are not returned,
+and responses are gzip compressed for user agents containing "gzip".
+"""
+import argparse
+import gzip
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs, unquote
+
+
+A1_CELL_REGEX = re.compile(r"^([A-Za-z]*)(\d*)$")
+# Google's limit on the grid cells of all the sheets of a document
+MAX_DOCUMENT_CELLS = 10000000
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeSheetsState(object):
+
+    def __init__(self, latency=0, quota_error_every=0, max_payload_bytes=10485760):
+        self.latency = latency
+        self.quota_error_every = quota_error_every
+        self.max_payload_bytes = max_payload_bytes
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.documents = {}
+            self.requests_count = 0
+            self.stats = {}
+
+    def record(self, operation, latency, request_bytes, response_bytes, status):
+        with self.lock:
+            stats = self.stats.setdefault(operation, {
+                "requests": 0, "errors": 0, "request_bytes": 0, "response_bytes": 0, "latencies": []
+            })
+            stats["requests"] += 1
+            stats["errors"] += 1 if status >= 400 else 0
+            stats["request_bytes"] += request_bytes
+            stats["response_bytes"] += response_bytes
+            stats["latencies"].append(latency)
+
+    def should_fail_on_quota(self):
+        with self.lock:
+            self.requests_count += 1
+            return self.quota_error_every > 0 and self.requests_count % self.quota_error_every == 0
+
+
+class APIError(Exception):
+    def __init__(self, code, status, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.status = status
+        self.message = message
+
+
+def column_letters_to_number(letters):
+    number = 0
+    for letter in letters.upper():
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def column_number_to_letters(number):
+    letters = ""
+    while number > 0:
+        number, remainder = divmod(number - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def parse_a1_range(a1_range):
+    """
+    'Sheet 1'!A2:C10 -> ("Sheet 1", 2, 1, 10, 3), open bounds being None
+    """
+    if "!" in a1_range:
+        title, cells = a1_range.rsplit("!", 1)
+    else:
+        title, cells = a1_range, ""
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    first_row = first_column = last_row = last_column = None
+    if cells:
+        bounds = cells.split(":")
+        first_column_letters, first_row_digits = A1_CELL_REGEX.match(bounds[0]).groups()
+        first_column = column_letters_to_number(first_column_letters) if first_column_letters else None
+        first_row = int(first_row_digits) if first_row_digits else None
+        if len(bounds) > 1:
+            last_column_letters, last_row_digits = A1_CELL_REGEX.match(bounds[1]).groups()
+            last_column = column_letters_to_number(last_column_letters) if last_column_letters else None
+            last_row = int(last_row_digits) if last_row_digits else None
+        else:
+            last_column, last_row = first_column, first_row
+    return title, first_row, first_column, last_row, last_column
+
+
+def format_a1_range(title, first_row, first_column, last_row, last_column):
+    return "'{}'!{}{}:{}{}".format(
+        title.replace("'", "''"),
+        column_number_to_letters(first_column), first_row,
+        column_number_to_letters(last_column), last_row
+    )
+
+
+def trim_values(values):
+    trimmed = []
+    for row in values:
+        while row and row[-1] in ("", None):
+            row = row[:-1]
+        trimmed.append(row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+class FakeDocument(object):
+
+    def __init__(self, document_id, title):
+        self.document_id = document_id
+        self.title = title
+        self.sheets = []
+        self.version = 1
+        self.decorations = 0
+
+    def add_sheet(self, title, row_count=1000, column_count=26, values=None):
+        self.sheets.append({
+            "sheetId": len(self.sheets),
+            "title": title,
+            "rowCount": row_count,
+            "columnCount": column_count,
+            "values": values or []
+        })
+        return self.sheets[-1]
+
+    def check_grid_size(self, sheet, row_count, column_count):
+        # Raised before changing anything, as the whole request is rejected
+        cells = row_count * column_count + sum(
+            other_sheet["rowCount"] * other_sheet["columnCount"] for other_sheet in self.sheets if other_sheet is not sheet
+        )
+        if cells > MAX_DOCUMENT_CELLS:
+            raise APIError(400, "INVALID_ARGUMENT", "This action would increase the number of cells in the workbook above the limit of {} cells.".format(
+                MAX_DOCUMENT_CELLS
+            ))
+
+    def get_sheet(self, title=None, sheet_id=None):
+        for sheet in self.sheets:
+            if (title is not None and sheet["title"] == title) or (sheet_id is not None and sheet["sheetId"] == sheet_id):
+                return sheet
+        raise APIError(400, "INVALID_ARGUMENT", "Unable to parse range: {}".format(title))
+
+    def get_metadata(self, fields=None):
+        metadata = {
+            "spreadsheetId": self.document_id,
+            "properties": {"title": self.title},
+            "sheets": [{
+                "properties": {
+                    "sheetId": sheet["sheetId"],
+                    "title": sheet["title"],
+                    "index": index,
+                    "sheetType": "GRID",
+                    "gridProperties": {"rowCount": sheet["rowCount"], "columnCount": sheet["columnCount"]}
+                }
+            } for index, sheet in enumerate(self.sheets)]
+        }
+        if not fields:
+            # Without a field mask, everything is returned, including the formatting of decorated workbooks
+            metadata["properties"].update({"locale": "en_US", "timeZone": "Etc/GMT", "autoRecalc": "ON_CHANGE"})
+            for sheet_metadata in metadata["sheets"]:
+                sheet_id = sheet_metadata["properties"]["sheetId"]
+                sheet_metadata["conditionalFormats"] = [{
+                    "ranges": [{"sheetId": sheet_id, "startRowIndex": index, "endRowIndex": index + 1}],
+                    "booleanRule": {
+                        "condition": {"type": "TEXT_CONTAINS", "values": [{"userEnteredValue": "value {}".format(index)}]},
+                        "format": {"backgroundColor": {"red": 1, "green": 0.8, "blue": 0.8}}
+                    }
+                } for index in range(self.decorations)]
+                sheet_metadata["protectedRanges"] = [{
+                    "protectedRangeId": index,
+                    "range": {"sheetId": sheet_id, "startRowIndex": index, "endRowIndex": index + 1},
+                    "warningOnly": True
+                } for index in range(self.decorations)]
+        return metadata
+
+    def get_bounds(self, a1_range):
+        title, first_row, first_column, last_row, last_column = parse_a1_range(a1_range)
+        sheet = self.get_sheet(title)
+        first_row = first_row or 1
+        first_column = first_column or 1
+        last_row = last_row or sheet["rowCount"]
+        last_column = last_column or sheet["columnCount"]
+        if last_row > sheet["rowCount"] or last_column > sheet["columnCount"]:
+            raise APIError(400, "INVALID_ARGUMENT", "Range ({}) exceeds grid limits. Max rows: {}, max columns: {}".format(
+                a1_range, sheet["rowCount"], sheet["columnCount"]
+            ))
+        return sheet, first_row, first_column, last_row, last_column
+
+    def get_values(self, a1_range):
+        sheet, first_row, first_column, last_row, last_column = self.get_bounds(a1_range)
+        values = [row[first_column - 1:last_column] for row in sheet["values"][first_row - 1:last_row]]
+        value_range = {
+            "range": format_a1_range(sheet["title"], first_row, first_column, last_row, last_column),
+            "majorDimension": "ROWS"
+        }
+        values = trim_values(values)
+        if values:
+            value_range["values"] = values
+        return value_range
+
+    def update_values(self, a1_range, values):
+        sheet, first_row, first_column, last_row, last_column = self.get_bounds(a1_range)
+        if len(values) > last_row - first_row + 1 or any(len(row) > last_column - first_column + 1 for row in values):
+            raise APIError(400, "INVALID_ARGUMENT", "Requested writing within range [{}], but tried writing beyond it".format(a1_range))
+        self.write_values(sheet, first_row, first_column, values)
+        number_of_columns = max([len(row) for row in values] or [0])
+        self.version += 1
+        return {
+            "spreadsheetId": self.document_id,
+            "updatedRange": format_a1_range(sheet["title"], first_row, first_column, first_row + len(values) - 1, first_column + max(number_of_columns, 1) - 1),
+            "updatedRows": len(values),
+            "updatedCells": sum(len(row) for row in values)
+        }
+
+    def write_values(self, sheet, first_row, first_column, values):
+        sheet_values = sheet["values"]
+        while len(sheet_values) < first_row - 1 + len(values):
+            sheet_values.append([])
+        for row_index, row in enumerate(values):
+            sheet_row = sheet_values[first_row - 1 + row_index]
+            if len(sheet_row) < first_column - 1 + len(row):
+                sheet_row.extend([""] * (first_column - 1 + len(row) - len(sheet_row)))
+            sheet_row[first_column - 1:first_column - 1 + len(row)] = row
+
+    def append_values(self, a1_range, values):
+        title, _, _, _, _ = parse_a1_range(a1_range)
+        sheet = self.get_sheet(title)
+        first_row = len(trim_values(sheet["values"])) + 1
+        last_row = first_row + len(values) - 1
+        number_of_columns = max([len(row) for row in values] or [1])
+        self.check_grid_size(sheet, max(sheet["rowCount"], last_row), max(sheet["columnCount"], number_of_columns))
+        sheet["rowCount"] = max(sheet["rowCount"], last_row)
+        sheet["columnCount"] = max(sheet["columnCount"], number_of_columns)
+        self.write_values(sheet, first_row, 1, values)
+        self.version += 1
+        return {
+            "spreadsheetId": self.document_id,
+            "tableRange": format_a1_range(sheet["title"], 1, 1, max(first_row - 1, 1), number_of_columns),
+            "updates": {
+                "spreadsheetId": self.document_id,
+                "updatedRange": format_a1_range(sheet["title"], first_row, 1, last_row, number_of_columns),
+                "updatedRows": len(values),
+                "updatedCells": sum(len(row) for row in values)
+            }
+        }
+
+    def clear_values(self, a1_range):
+        sheet, first_row, first_column, last_row, last_column = self.get_bounds(a1_range)
+        for row in sheet["values"][first_row - 1:last_row]:
+            for column_index in range(first_column - 1, min(last_column, len(row))):
+                row[column_index] = ""
+        self.version += 1
+        return {"spreadsheetId": self.document_id, "clearedRange": a1_range}
+
+    def batch_update(self, requests):
+        replies = []
+        for request in requests:
+            if "updateSheetProperties" in request:
+                properties = request["updateSheetProperties"]["properties"]
+                sheet = self.get_sheet(sheet_id=properties.get("sheetId", 0))
+                grid_properties = properties.get("gridProperties", {})
+                self.check_grid_size(
+                    sheet, grid_properties.get("rowCount", sheet["rowCount"]), grid_properties.get("columnCount", sheet["columnCount"])
+                )
+                if "rowCount" in grid_properties:
+                    sheet["rowCount"] = grid_properties["rowCount"]
+                    del sheet["values"][sheet["rowCount"]:]
+                if "columnCount" in grid_properties:
+                    sheet["columnCount"] = grid_properties["columnCount"]
+                    for row in sheet["values"]:
+                        del row[sheet["columnCount"]:]
+                if "title" in properties:
+                    sheet["title"] = properties["title"]
+                replies.append({})
+            elif "appendDimension" in request:
+                append_dimension = request["appendDimension"]
+                sheet = self.get_sheet(sheet_id=append_dimension.get("sheetId", 0))
+                columns_length = append_dimension.get("length", 0) if append_dimension.get("dimension") == "COLUMNS" else 0
+                self.check_grid_size(
+                    sheet, sheet["rowCount"] + append_dimension.get("length", 0) - columns_length, sheet["columnCount"] + columns_length
+                )
+                if append_dimension.get("dimension") == "COLUMNS":
+                    sheet["columnCount"] += append_dimension.get("length", 0)
+                else:
+                    sheet["rowCount"] += append_dimension.get("length", 0)
+                replies.append({})
+            elif "deleteDimension" in request:
+                dimension_range = request["deleteDimension"]["range"]
+                sheet = self.get_sheet(sheet_id=dimension_range.get("sheetId", 0))
+                start_index, end_index = dimension_range["startIndex"], dimension_range["endIndex"]
+                if dimension_range.get("dimension") == "COLUMNS":
+                    for row in sheet["values"]:
+                        del row[start_index:end_index]
+                    sheet["columnCount"] -= end_index - start_index
+                else:
+                    del sheet["values"][start_index:end_index]
+                    sheet["rowCount"] -= end_index - start_index
+                replies.append({})
+            elif "addSheet" in request:
+                properties = request["addSheet"].get("properties", {})
+                grid_properties = properties.get("gridProperties", {})
+                if any(sheet["title"] == properties.get("title") for sheet in self.sheets):
+                    raise APIError(400, "INVALID_ARGUMENT", "A sheet with the name \"{}\" already exists.".format(properties.get("title")))
+                self.check_grid_size(None, grid_properties.get("rowCount", 1000), grid_properties.get("columnCount", 26))
+                sheet = self.add_sheet(
+                    properties.get("title", "Sheet{}".format(len(self.sheets) + 1)),
+                    grid_properties.get("rowCount", 1000),
+                    grid_properties.get("columnCount", 26)
+                )
+                replies.append({"addSheet": {"properties": {
+                    "sheetId": sheet["sheetId"],
+                    "title": sheet["title"],
+                    "index": len(self.sheets) - 1,
+                    "sheetType": "GRID",
+                    "gridProperties": {"rowCount": sheet["rowCount"], "columnCount": sheet["columnCount"]}
+                }}})
+            else:
+                replies.append({})
+        self.version += 1
+        return {"spreadsheetId": self.document_id, "replies": replies}
+
+
+class FakeSheetsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_api_request("GET")
+
+    def do_POST(self):
+        self.handle_api_request("POST")
+
+    def do_PUT(self):
+        self.handle_api_request("PUT")
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        # Like Google, responses are only compressed for user agents containing "gzip"
+        if "gzip" in self.headers.get("Accept-Encoding", "") and "gzip" in self.headers.get("User-Agent", ""):
+            body = gzip.compress(body, compresslevel=6)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return len(body)
+
+    def handle_api_request(self, method):
+        state = self.server.state
+        start = time.perf_counter()
+        body = self.read_body()
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        operation = "unknown"
+        try:
+            if url.path.startswith("/_"):
+                status, payload = 200, self.handle_control(url.path, body)
+                self.send_json(status, payload)
+                return
+            operation, handler = self.route(method, url.path)
+            if state.latency:
+                time.sleep(state.latency)
+            if len(body) > state.max_payload_bytes:
+                raise APIError(400, "INVALID_ARGUMENT", "Request payload size exceeds the limit: {} bytes.".format(state.max_payload_bytes))
+            if state.should_fail_on_quota():
+                raise APIError(429, "RESOURCE_EXHAUSTED", "Quota exceeded for quota metric 'Requests' and limit 'Requests per minute per user'")
+            with state.lock:
+                status, payload = 200, handler(query, json.loads(body.decode("utf-8")) if body else {})
+        except APIError as error:
+            status, payload = error.code, {"error": {"code": error.code, "message": error.message, "status": error.status}}
+        response_bytes = self.send_json(status, payload)
+        state.record(operation, time.perf_counter() - start, len(body), response_bytes, status)
+
+    def handle_control(self, path, body):
+        state = self.server.state
+        if path == "/_reset":
+            state.reset()
+            return {}
+        if path == "/_stats":
+            with state.lock:
+                return state.stats
+        if path == "/_generate":
+            parameters = json.loads(body.decode("utf-8"))
+            document = FakeDocument(parameters["document_id"], parameters.get("title", "Benchmark"))
+            document.decorations = parameters.get("decorations", 0)
+            for tab_index in range(parameters.get("tabs", 1)):
+                rows, columns = parameters.get("rows", 0), parameters.get("columns", 1)
+                values = [["Column {}".format(column) for column in range(columns)]]
+                values.extend([["r{}c{}".format(row, column) for column in range(columns)] for row in range(rows)])
+                document.add_sheet("Sheet{}".format(tab_index + 1), max(rows + 1, 1), max(columns, 1), values)
+            with state.lock:
+                state.documents[document.document_id] = document
+            return {}
+        raise APIError(404, "NOT_FOUND", "Unknown control endpoint")
+
+    def get_document(self, document_id):
+        document = self.server.state.documents.get(document_id)
+        if document is None:
+            raise APIError(404, "NOT_FOUND", "Requested entity was not found.")
+        return document
+
+    def route(self, method, path):
+        if path.startswith("/drive/v3/files/"):
+            document_id = path[len("/drive/v3/files/"):]
+            return "drive.files.get", lambda query, body: {
+                "version": str(self.get_document(document_id).version),
+                "modifiedTime": "2024-01-01T00:00:00.000Z"
+            }
+        if not path.startswith("/v4/spreadsheets/"):
+            raise APIError(404, "NOT_FOUND", "Unknown endpoint {}".format(path))
+        path = path[len("/v4/spreadsheets/"):]
+        if "/values" not in path:
+            if path.endswith(":batchUpdate") and method == "POST":
+                document_id = path[:-len(":batchUpdate")]
+                return "batchUpdate", lambda query, body: self.get_document(document_id).batch_update(body.get("requests", []))
+            if method == "GET":
+                return "get", lambda query, body: self.get_document(path).get_metadata(query.get("fields"))
+        document_id, values_path = path.split("/values", 1)
+        if values_path == ":batchGet" and method == "GET":
+            return "values.batchGet", lambda query, body: {
+                "spreadsheetId": document_id,
+                "valueRanges": [self.get_document(document_id).get_values(a1_range) for a1_range in query.get("ranges", [])]
+            }
+        if values_path == ":batchUpdate" and method == "POST":
+            return "values.batchUpdate", lambda query, body: {
+                "spreadsheetId": document_id,
+                "responses": [
+                    self.get_document(document_id).update_values(data["range"], data.get("values", [])) for data in body.get("data", [])
+                ]
+            }
+        a1_range = unquote(values_path[1:])
+        if a1_range.endswith(":append") and method == "POST":
+            return "values.append", lambda query, body: self.get_document(document_id).append_values(a1_range[:-len(":append")], body.get("values", []))
+        if a1_range.endswith(":clear") and method == "POST":
+            return "values.clear", lambda query, body: self.get_document(document_id).clear_values(a1_range[:-len(":clear")])
+        if method == "GET":
+            return "values.get", lambda query, body: self.get_document(document_id).get_values(a1_range)
+        if method == "PUT":
+            return "values.update", lambda query, body: self.get_document(document_id).update_values(a1_range, body.get("values", []))
+        raise APIError(404, "NOT_FOUND", "Unknown endpoint {}".format(path))
+
+
+def get_server(port=0, latency=0, quota_error_every=0, max_payload_bytes=10485760):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeSheetsHandler)
+    server.state = FakeSheetsState(latency, quota_error_every, max_payload_bytes)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Google Sheets API")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per request, in seconds")
+    parser.add_argument("--quota-error-every", type=int, default=0, help="Answer 429 to one request out of n")
+    parser.add_argument("--max-payload-bytes", type=int, default=10485760)
+    args = parser.parse_args()
+    server = get_server(args.port, args.latency, args.quota_error_every, args.max_payload_bytes)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark of the conversion of sheet rows to the records yielded by the connector's generate_rows,
+for a wide sheet read with the "first row header" format and the sheet name column.
+
+    PYTHONPATH=python-lib python3 tests/python/benchmark/rows_emission_benchmark.py
+"""
+import time
+import tracemalloc
+from collections import OrderedDict
+from googlesheets_rows import iter_header_records
+
+NUMBER_OF_ROWS = 50000
+NUMBER_OF_COLUMNS = 60
+SHEET_NAME = "Sheet1"
+
+
+def get_rows():
+    rows = []
+    for index in range(NUMBER_OF_ROWS):
+        # One row out of ten is ragged, as returned by the API when trailing cells are empty
+        width = NUMBER_OF_COLUMNS - 7 if index % 10 == 0 else NUMBER_OF_COLUMNS
+        rows.append(["value {} {}".format(index, column) for column in range(width)])
+    return rows
+
+
+def iter_legacy_records(rows, columns_slug):
+    # Emission as done before, with rows padded by get_all_values
+    for row in rows:
+        row = row + [""] * (NUMBER_OF_COLUMNS - len(row))
+        row.insert(0, "{}".format(SHEET_NAME))
+        yield OrderedDict(zip(columns_slug, row))
+
+
+def iter_records(rows, columns_slug):
+    return iter_header_records(rows, columns_slug[1:], columns_slug[0], SHEET_NAME)
+
+
+def measure_speed(emission, rows, columns_slug):
+    start = time.perf_counter()
+    for _ in emission(rows, columns_slug):
+        pass
+    return NUMBER_OF_ROWS / (time.perf_counter() - start)
+
+
+def measure_memory(emission, rows, columns_slug):
+    tracemalloc.start()
+    records = list(emission(rows, columns_slug))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current / NUMBER_OF_ROWS
+
+
+def run():
+    rows = get_rows()
+    columns_slug = ["Sheet_name"] + ["column_{}".format(column) for column in range(NUMBER_OF_COLUMNS)]
+    assert [dict(record) for record in iter_legacy_records(rows[:20], columns_slug)] == list(iter_records(rows[:20], columns_slug))
+
+    print("{} rows x {} columns".format(NUMBER_OF_ROWS, NUMBER_OF_COLUMNS))
+    for label, emission in [("legacy OrderedDict + insert", iter_legacy_records), ("iter_header_records", iter_records)]:
+        rows_per_second = max(measure_speed(emission, rows, columns_slug) for _ in range(3))
+        bytes_per_row = measure_memory(emission, rows, columns_slug)
+        print("{}: {:.0f} rows/s, {:.0f} bytes allocated per row".format(label, rows_per_second, bytes_per_row))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,69 @@
+"""
+Benchmark of the append recipe's serialization of input rows to Sheets API values,
+row by row as iter_rows yields them, and by chunks as iter_dataframes yields them.
+
+    PYTHONPATH=python-lib python3 tests/python/benchmark/serialization_benchmark.py
+"""
+import datetime
+import timeit
+import pandas
+from googlesheets_common import DSSConstants
+from googlesheets_serialization import serialize_dataframe
+
+NUMBER_OF_ROWS = 100000
+CHUNK_SIZE = DSSConstants.INPUT_CHUNK_SIZE
+REPEAT = 3
+
+
+def get_dataframe():
+    start = datetime.datetime(2020, 1, 1)
+    return pandas.DataFrame({
+        "label": ["label {}".format(index) for index in range(NUMBER_OF_ROWS)],
+        "count": list(range(NUMBER_OF_ROWS)),
+        "ratio": [index / 7.0 if index % 10 else None for index in range(NUMBER_OF_ROWS)],
+        "created": [start + datetime.timedelta(minutes=17 * index) for index in range(NUMBER_OF_ROWS)],
+        "updated": [start + datetime.timedelta(seconds=13 * index) for index in range(NUMBER_OF_ROWS)]
+    })
+
+
+def serializer_dss(obj):
+    # Serializer used before, called on each value of each row
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(DSSConstants.GSPREAD_DATE_FORMAT)
+    return obj
+
+
+def serialize_rows(rows):
+    return [[serializer_dss(value) for key, value in list(row.items())] for row in rows]
+
+
+def serialize_chunks(dataframe):
+    rows = []
+    for start in range(0, len(dataframe), CHUNK_SIZE):
+        rows.extend(serialize_dataframe(dataframe.iloc[start:start + CHUNK_SIZE], "USER_ENTERED"))
+    return rows
+
+
+def run():
+    dataframe = get_dataframe()
+    # Rows as yielded by iter_rows, with python values and datetimes
+    rows = [
+        {key: (None if pandas.isnull(value) else value) for key, value in record.items()}
+        for record in dataframe.astype(object).to_dict("records")
+    ]
+    for row in rows:
+        row["created"] = row["created"].to_pydatetime()
+        row["updated"] = row["updated"].to_pydatetime()
+    reference = [[value if value is not None else "" for value in row] for row in serialize_rows(rows)]
+    assert serialize_chunks(dataframe) == reference
+
+    rows_time = min(timeit.repeat(lambda: serialize_rows(rows), number=1, repeat=REPEAT))
+    chunks_time = min(timeit.repeat(lambda: serialize_chunks(dataframe), number=1, repeat=REPEAT))
+    print("{} rows x {} columns".format(NUMBER_OF_ROWS, len(dataframe.columns)))
+    print("row by row serializer: {:.3f}s ({:.0f} rows/s)".format(rows_time, NUMBER_OF_ROWS / rows_time))
+    print("serialize_dataframe by chunks of {}: {:.3f}s ({:.0f} rows/s)".format(CHUNK_SIZE, chunks_time, NUMBER_OF_ROWS / chunks_time))
+    print("speedup: x{:.1f}".format(rows_time / chunks_time))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,132 @@
+from gspread.utils import a1_to_rowcol
+from googlesheets import GoogleSheetsSession, get_read_windows, iter_windows_rows
+from googlesheets_common import DSSConstants, get_read_last_row
+
+
+class FakeSpreadsheet(object):
+    def __init__(self, spreadsheet_id="document"):
+        self.id = spreadsheet_id
+
+
+class FakeWorksheet(object):
+    def __init__(self, title, rows, row_count=None, col_count=2, spreadsheet=None):
+        self.title = title
+        self.rows = rows
+        self.row_count = row_count or len(rows)
+        self.col_count = col_count
+        self.spreadsheet = spreadsheet or FakeSpreadsheet()
+
+
+class FakeSession(GoogleSheetsSession):
+    # Session without credentials, whose values:batchGet requests are answered from the fake worksheets
+    def __init__(self, worksheets):
+        self.worksheets = dict((worksheet.title, worksheet) for worksheet in worksheets)
+        self.requests = []
+
+    def batch_get_ranges(self, spreadsheet, ranges, tabs_ids, value_render_option="FORMATTED_VALUE"):
+        self.requests.append(ranges)
+        values_of_ranges = []
+        for a1_range in ranges:
+            title, cells = a1_range.rsplit("!", 1)
+            first_cell, last_cell = cells.split(":")
+            first_row, last_row = a1_to_rowcol(first_cell)[0], a1_to_rowcol(last_cell)[0]
+            values = self.worksheets[title.strip("'")].rows[first_row - 1:last_row]
+            # Like the API, trailing empty rows are not returned
+            while values and not values[-1]:
+                values = values[:-1]
+            values_of_ranges.append(values)
+        return values_of_ranges
+
+
+def get_rows(count, width=2):
+    return [["{}".format(row)] * width for row in range(1, count + 1)]
+
+
+def test_get_read_windows():
+    worksheet = FakeWorksheet("Sheet1", [], row_count=25)
+    assert get_read_windows(worksheet, window_size=10) == [(1, 10), (11, 20), (21, 25)]
+    assert get_read_windows(worksheet, first_row=3, last_row=22, window_size=10) == [(3, 12), (13, 22)]
+    assert get_read_windows(worksheet, last_row=1000, window_size=20) == [(1, 20), (21, 25)]
+    assert get_read_windows(worksheet, window_size=None) == [(1, 25)]
+    assert get_read_windows(worksheet, window_size=-1) == [(1, 25)]
+    assert get_read_windows(worksheet, first_row=26, window_size=10) == []
+
+
+def test_iter_windows_rows():
+    fetched_windows = [(1, 3, [["a"], [], ["b"]]), (4, 6, []), (7, 9, [[], ["c"]]), (10, 12, [])]
+    assert list(iter_windows_rows(fetched_windows)) == [["a"], [], ["b"], [], [], [], [], ["c"]]
+    assert list(iter_windows_rows([(1, 5, []), (6, 10, [])])) == []
+
+
+def test_iter_worksheets_rows():
+    first_worksheet = FakeWorksheet("Sheet1", get_rows(25), row_count=40)
+    second_worksheet = FakeWorksheet("Sheet 2", [["x"], [], ["y"]], row_count=10)
+    session = FakeSession([first_worksheet, second_worksheet])
+    worksheets_rows = [
+        (worksheet.title, list(rows)) for worksheet, rows in session.iter_worksheets_rows([first_worksheet, second_worksheet], window_size=10)
+    ]
+    assert worksheets_rows == [("Sheet1", get_rows(25)), ("Sheet 2", [["x"], [], ["y"]])]
+    # Windows of all the sheets, the empty trailing ones included, are fetched in a single request
+    assert len(session.requests) == 1
+    assert session.requests[0][-1] == "'Sheet 2'!A1:B10"
+
+
+def test_iter_worksheets_rows_skips_unconsumed_rows():
+    first_worksheet = FakeWorksheet("Sheet1", get_rows(30))
+    second_worksheet = FakeWorksheet("Sheet2", get_rows(5))
+    session = FakeSession([first_worksheet, second_worksheet])
+    worksheets_rows = session.iter_worksheets_rows([first_worksheet, second_worksheet], window_size=10)
+    worksheet, rows = next(worksheets_rows)
+    assert next(rows) == ["1", "1"]
+    worksheet, rows = next(worksheets_rows)
+    assert (worksheet.title, list(rows)) == ("Sheet2", get_rows(5))
+
+
+def test_batches_limited_in_ranges():
+    worksheet = FakeWorksheet("Sheet1", get_rows(120, 1), col_count=1)
+    session = FakeSession([worksheet])
+    assert list(session.iter_worksheet_rows(worksheet, window_size=1)) == get_rows(120, 1)
+    assert [len(ranges) for ranges in session.requests] == [
+        DSSConstants.MAX_RANGES_PER_READ_REQUEST, DSSConstants.MAX_RANGES_PER_READ_REQUEST, 20
+    ]
+
+
+def test_batches_limited_in_cells():
+    # Cells are counted on the whole grid width, whatever the values returned
+    worksheet = FakeWorksheet("Sheet1", get_rows(30), row_count=30, col_count=10)
+    session = FakeSession([worksheet])
+    windows = [(worksheet, window) for window in get_read_windows(worksheet, window_size=5)]
+    fetched_windows = list(session.iter_fetched_windows(windows, max_cells=100))
+    assert [(first_row, last_row) for first_row, last_row, _ in fetched_windows] == [(1, 5), (6, 10), (11, 15), (16, 20), (21, 25), (26, 30)]
+    assert [len(ranges) for ranges in session.requests] == [2, 2, 2]
+    assert len(list(FakeSession([worksheet]).iter_fetched_windows(windows[:1], max_cells=10))) == 1
+
+
+def test_batches_split_by_spreadsheet():
+    first_worksheet = FakeWorksheet("Sheet1", get_rows(3), spreadsheet=FakeSpreadsheet("first"))
+    second_worksheet = FakeWorksheet("Sheet2", get_rows(3), spreadsheet=FakeSpreadsheet("second"))
+    session = FakeSession([first_worksheet, second_worksheet])
+    windows = [(first_worksheet, (1, 3)), (second_worksheet, (1, 3))]
+    assert len(list(session.iter_fetched_windows(windows))) == 2
+    assert session.requests == [["'Sheet1'!A1:B3"], ["'Sheet2'!A1:B3"]]
+
+
+def test_read_stops_early():
+    # Previews only ask for the rows they need, and windows are fetched as rows are consumed
+    worksheet = FakeWorksheet("Sheet1", get_rows(1000, 1), col_count=1)
+    session = FakeSession([worksheet])
+    rows = session.iter_worksheet_rows(worksheet, first_row=2, last_row=11, window_size=100)
+    assert list(rows) == get_rows(11, 1)[1:]
+    assert session.requests == [["'Sheet1'!A2:A11"]]
+    session = FakeSession([worksheet])
+    rows = session.iter_worksheet_rows(worksheet, window_size=10)
+    assert [next(rows) for _ in range(15)] == get_rows(15, 1)
+    assert sum(len(ranges) for ranges in session.requests) == DSSConstants.MAX_RANGES_PER_READ_REQUEST
+
+
+def test_get_read_last_row():
+    assert get_read_last_row(0, "first-row-header", 10) == 11
+    assert get_read_last_row(3, "no-header", 10) == 13
+    assert get_read_last_row(3, "first-row-header", -1) is None
+    assert get_read_last_row(3, "first-row-header", 0) is None
+    assert get_read_last_row(3, "first-row-header", None) is None
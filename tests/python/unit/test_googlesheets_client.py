@@ -0,0 +1,74 @@
+import socket
+import pytest
+import requests
+import googlesheets_client
+from googlesheets_client import GoogleSheetsClient, TokenBucket, TimeoutHTTPAdapter, is_retryable_error
+from googlesheets_metrics import APIMetrics
+
+
+class FakeResponse(object):
+    ok = True
+    content = b"{}"
+
+    class Request(object):
+        body = b""
+
+    request = Request()
+
+    def json(self):
+        return {}
+
+
+class FakeHttpSession(object):
+    def get(self, endpoint, **kwargs):
+        return FakeResponse()
+
+
+def test_token_bucket_burst():
+    token_bucket = TokenBucket(60, burst_seconds=5)
+    assert token_bucket.capacity == 5
+    token_bucket.acquire()
+    assert token_bucket.tokens < 5
+    token_bucket = TokenBucket(6000, burst_seconds=5)
+    assert token_bucket.capacity == 500
+    assert TokenBucket(6, burst_seconds=5).capacity == 1
+
+
+def test_token_bucket_throttles_after_burst():
+    token_bucket = TokenBucket(6000, burst_seconds=0.1)
+    assert token_bucket.capacity == 10
+    for _ in range(10):
+        token_bucket.acquire()
+    assert token_bucket.tokens < 1
+    token_bucket.acquire()
+    assert token_bucket.tokens < 1
+
+
+def test_stalled_connection_times_out():
+    # The server accepts the connection but never answers
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    session = requests.Session()
+    session.mount("http://", TimeoutHTTPAdapter(timeout=(1, 0.2)))
+    try:
+        with pytest.raises(requests.exceptions.Timeout) as error:
+            session.get("http://127.0.0.1:{}/".format(server.getsockname()[1]))
+        assert is_retryable_error(error.value)
+    finally:
+        server.close()
+
+
+def test_shared_client_metrics(monkeypatch):
+    # Sessions of a process share their client, each one only recording its own calls
+    monkeypatch.setattr(TokenBucket, "acquire", lambda token_bucket: None)
+    client = GoogleSheetsClient(None, session=FakeHttpSession())
+    first_metrics, second_metrics = APIMetrics(), APIMetrics()
+    first_client, second_client = client.get_session_client(first_metrics), client.get_session_client(second_metrics)
+    first_client.request("get", googlesheets_client.SPREADSHEET_URL % "first")
+    second_client.request("get", googlesheets_client.SPREADSHEET_URL % "second")
+    second_client.request("get", googlesheets_client.SPREADSHEET_URL % "second")
+    client.request("get", googlesheets_client.SPREADSHEET_URL % "other")
+    assert (first_metrics.get_summary()["calls"], first_metrics.get_summary()["documents"]) == (1, ["first"])
+    assert (second_metrics.get_summary()["calls"], second_metrics.get_summary()["documents"]) == (2, ["second"])
+    assert second_client.session is client.session
@@ -0,0 +1,72 @@
+import random
+from googlesheets_common import DSSConstants, get_number_of_workers, get_partition_tab_title, get_tab_partition_id, get_unique_names, get_unique_slugs, slugify_name, UniqueNamesAllocator
+
+
+def test_get_partition_tab_title():
+    assert get_partition_tab_title("Sales %{tab}", "2024-01") == "Sales 2024-01"
+    assert get_partition_tab_title(None, "2024-01") == "2024-01"
+
+
+def test_get_tab_partition_id():
+    assert get_tab_partition_id("Sales %{tab}", "Sales 2024-01") == "2024-01"
+    assert get_tab_partition_id("Sales %{tab} (final)", "Sales 2024-01 (final)") == "2024-01"
+    assert get_tab_partition_id("Sales %{tab}", "Costs 2024-01") is None
+    assert get_tab_partition_id("Sales %{tab}", "Sales ") is None
+    assert get_tab_partition_id("%{tab}", "a.b (1)") == "a.b (1)"
+
+
+def test_partition_tab_round_trip():
+    for tabs_pattern in ["%{tab}", "Sales %{tab}", "[%{tab}]"]:
+        for partition_id in ["2024-01", "FR", "a b"]:
+            assert get_tab_partition_id(tabs_pattern, get_partition_tab_title(tabs_pattern, partition_id)) == partition_id
+
+
+def get_unique_names_by_search(list_of_names, existing_names=()):
+    # Previous algorithm, searching for a free suffix from _1 for each name
+    unique_names = []
+    for name in list(existing_names) + list_of_names:
+        name = name or 'none'
+        unique_name = name
+        suffix = 0
+        while unique_name in unique_names:
+            suffix += 1
+            unique_name = name + '_' + str(suffix)
+        unique_names.append(unique_name)
+    return unique_names[len(existing_names):]
+
+
+def test_unique_names_allocator():
+    assert get_unique_names(["a", "a", "", "a_1", "a"]) == ["a", "a_1", "none", "a_1_1", "a_2"]
+    assert get_unique_slugs(["A b", "A-b", "é"]) == ["A_b", "A_b_1", "e"]
+
+
+def test_unique_names_allocator_matches_search():
+    random_generator = random.Random(0)
+    alphabet = ["a", "b", "_", "1", "2", ""]
+    for _ in range(200):
+        names = [
+            "".join(random_generator.choice(alphabet) for _ in range(random_generator.randint(0, 4)))
+            for _ in range(random_generator.randint(0, 30))
+        ]
+        existing_names = names[:random_generator.randint(0, 5)]
+        allocator = UniqueNamesAllocator(existing_names=existing_names)
+        assert [allocator.allocate(name) for name in names] == get_unique_names_by_search(names, existing_names)
+
+
+def test_unique_slugs_match_search():
+    random_generator = random.Random(1)
+    alphabet = ["A", "b", "_", "-", " ", "1", "é"]
+    for _ in range(200):
+        names = [
+            "".join(random_generator.choice(alphabet) for _ in range(random_generator.randint(0, 4)))
+            for _ in range(random_generator.randint(0, 30))
+        ]
+        assert get_unique_slugs(names) == get_unique_names_by_search([slugify_name(name) for name in names])
+
+
+def test_get_number_of_workers():
+    assert get_number_of_workers({}, "upload_workers", 4) == 4
+    assert get_number_of_workers({"upload_workers": None}, "upload_workers", 4) == 4
+    assert get_number_of_workers({"upload_workers": 8}, "upload_workers", 4) == 8
+    assert get_number_of_workers({"upload_workers": 100}, "upload_workers", 4) == DSSConstants.HTTP_POOL_SIZE
+    assert get_number_of_workers({"upload_workers": -2}, "upload_workers", 4) == 1
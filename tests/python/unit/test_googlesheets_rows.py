@@ -0,0 +1,53 @@
+import json
+from googlesheets_common import UniqueNamesAllocator, slugify_name, pad_row
+from googlesheets_rows import iter_header_records, iter_no_header_records, iter_json_records, peek_rows_width
+
+
+def get_header_records(rows, sample_size=None):
+    # Same steps as the connector, for a sheet read with a first row header
+    rows = iter(rows)
+    header = next(rows)
+    number_of_columns, rows = peek_rows_width(rows, sample_size)
+    allocator = UniqueNamesAllocator(normalize=slugify_name)
+    keys = [allocator.allocate("{}".format(column)) for column in pad_row(header, max(number_of_columns, len(header)))]
+    return list(iter_header_records(rows, keys, get_extra_key=lambda: allocator.allocate("")))
+
+
+def test_peek_rows_width():
+    number_of_columns, rows = peek_rows_width(iter([["a"], ["a", "b", "c"], [], ["a", "b", "c", "d"]]), 3)
+    assert number_of_columns == 3
+    assert list(rows) == [["a"], ["a", "b", "c"], [], ["a", "b", "c", "d"]]
+    number_of_columns, rows = peek_rows_width(iter([]))
+    assert (number_of_columns, list(rows)) == (0, [])
+
+
+def test_header_records_blank_header_cell():
+    records = get_header_records([["a", "b"], ["1", "2", "3"], ["4"]])
+    assert records == [{"a": "1", "b": "2", "none": "3"}, {"a": "4", "b": "", "none": ""}]
+    records = get_header_records([["a", "", "c"], ["1", "2", "3", "4"]])
+    assert records == [{"a": "1", "none": "2", "c": "3", "none_1": "4"}]
+
+
+def test_header_records_ragged_rows():
+    # Rows wider than the first window are not truncated either
+    records = get_header_records([["a"], ["1"], ["2", "3"], ["4", "5", "6"]], sample_size=2)
+    assert records == [{"a": "1", "none": ""}, {"a": "2", "none": "3"}, {"a": "4", "none": "5", "none_1": "6"}]
+
+
+def test_header_records_truncated_without_extra_keys():
+    assert list(iter_header_records([["1", "2", "3"]], ["a", "b"])) == [{"a": "1", "b": "2"}]
+
+
+def test_no_header_records_same_keys():
+    records = list(iter_no_header_records([["1"], ["1", "2", "3"]], number_of_columns=3))
+    assert records == [{1: "1", 2: "", 3: ""}, {1: "1", 2: "2", 3: "3"}]
+    records = list(iter_no_header_records([["1"]], sheet_name="Sheet1", number_of_columns=2))
+    assert records == [{1: "Sheet1", 2: "1", 3: ""}]
+    assert list(iter_no_header_records([["1", "2"]], number_of_columns=1)) == [{1: "1", 2: "2"}]
+
+
+def test_json_records_same_length():
+    records = list(iter_json_records([["1"], [], ["1", "2"]], number_of_columns=2))
+    assert [json.loads(record["json"]) for record in records] == [["1", ""], ["", ""], ["1", "2"]]
+    records = list(iter_json_records([["1"]], sheet_name="Sheet1", number_of_columns=2))
+    assert json.loads(records[0]["json"]) == ["Sheet1", "1", ""]
@@ -0,0 +1,66 @@
+from googlesheets_schema import infer_column_type, merge_column_types, infer_schema, serial_number_to_date
+
+
+def test_infer_column_type_numbers():
+    assert infer_column_type([1, 2, 3]) == "bigint"
+    assert infer_column_type([1, 2.0, ""]) == "bigint"
+    assert infer_column_type([1, 2.5]) == "double"
+    assert infer_column_type([0.1]) == "double"
+    assert infer_column_type([True, False, None]) == "boolean"
+
+
+def test_infer_column_type_mixed_values():
+    assert infer_column_type([1, "a"]) == "string"
+    assert infer_column_type([1.5, True]) == "string"
+    assert infer_column_type([True, "TRUE"]) == "string"
+
+
+def test_infer_column_type_empty_column():
+    assert infer_column_type([]) == "string"
+    assert infer_column_type(["", None, ""]) == "string"
+    assert infer_column_type([], number_formats={"DATE"}) == "string"
+
+
+def test_infer_column_type_dates():
+    assert infer_column_type([43831, 43831.5], number_formats={"DATE", "DATE_TIME"}) == "date"
+    # A single cell not formatted as a date makes it a number column
+    assert infer_column_type([43831, 2.5], number_formats={"DATE", "NUMBER"}) == "double"
+    assert infer_column_type(["2020-01-01"], number_formats={"DATE"}) == "string"
+
+
+def test_merge_column_types():
+    assert merge_column_types(None, "bigint") == "bigint"
+    assert merge_column_types("bigint", "bigint") == "bigint"
+    assert merge_column_types("bigint", "double") == "double"
+    assert merge_column_types("double", "bigint") == "double"
+    assert merge_column_types("bigint", "boolean") == "string"
+    assert merge_column_types("date", "double") == "string"
+
+
+def test_infer_schema_ragged_rows():
+    rows = [[1, "a", 2.5], [2], [3, "", 4]]
+    assert infer_schema(["id", "name", "value"], rows, [set(), set(), {"NUMBER"}]) == [
+        {"name": "id", "type": "bigint"},
+        {"name": "name", "type": "string"},
+        {"name": "value", "type": "double"}
+    ]
+
+
+def test_serial_number_to_date():
+    assert serial_number_to_date(0) == "1899-12-30T00:00:00.000Z"
+    assert serial_number_to_date(-1) == "1899-12-29T00:00:00.000Z"
+    assert serial_number_to_date(43831) == "2020-01-01T00:00:00.000Z"
+    assert serial_number_to_date(43831.75) == "2020-01-01T18:00:00.000Z"
+    assert serial_number_to_date(43831 + (10 * 3600 + 0.123) / 86400) == "2020-01-01T10:00:00.123Z"
+
+
+def test_serial_number_to_date_fractions_rounding():
+    # Serial numbers of whole seconds do not come out a millisecond early
+    for seconds in range(0, 86400, 7):
+        assert serial_number_to_date(45000 + seconds / 86400.0).endswith(":{:02d}.000Z".format(seconds % 60))
+
+
+def test_serial_number_to_date_other_values():
+    assert serial_number_to_date("") == ""
+    assert serial_number_to_date("2020-01-01") == "2020-01-01"
+    assert serial_number_to_date(True) is True
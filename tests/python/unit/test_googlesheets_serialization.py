@@ -0,0 +1,41 @@
+import datetime
+import io
+import json
+import pandas
+from googlesheets_serialization import serialize_dataframe, iter_dataset_dataframes
+
+
+class FakeDataset(object):
+    def __init__(self, csv_data, dtypes):
+        self.csv_data = csv_data
+        self.dtypes = dtypes
+
+    def iter_dataframes(self, chunksize, infer_with_pandas=True, use_nullable_integers=False, keep_default_na=True, na_values=None):
+        # DSS reads the dataset as a CSV stream with the types of the schema
+        return pandas.read_csv(
+            io.StringIO(self.csv_data), dtype=self.dtypes, chunksize=chunksize, keep_default_na=keep_default_na, na_values=na_values
+        )
+
+
+def test_serialize_dataframe_missing_values():
+    dataframe = pandas.DataFrame({
+        "integer": pandas.array([1, None, 3], dtype="Int64"),
+        "boolean": pandas.array([True, None, False], dtype="boolean"),
+        "float": [1.5, None, 2.0],
+        "string": ["a", None, "c"]
+    })
+    rows = serialize_dataframe(dataframe)
+    assert rows == [[1, True, 1.5, "a"], ["", "", "", ""], [3, False, 2.0, "c"]]
+    assert json.dumps(rows)
+
+
+def test_serialize_dataframe_dates():
+    dataframe = pandas.DataFrame({"date": [datetime.datetime(2020, 1, 2, 3, 4, 5, 6), None]})
+    assert serialize_dataframe(dataframe, "USER_ENTERED") == [["2020-01-02 03:04:05"], [""]]
+    assert serialize_dataframe(dataframe, "RAW") == [["2020-01-02T03:04:05.000006"], [""]]
+
+
+def test_dataset_dataframes_keep_na_strings():
+    dataset = FakeDataset("string,integer\nNA,1\nN/A,\nnull,3\nNone,4\nnan,5\n,6\n", {"string": str, "integer": "Int64"})
+    rows = [row for dataframe in iter_dataset_dataframes(dataset, chunksize=4) for row in serialize_dataframe(dataframe)]
+    assert rows == [["NA", 1], ["N/A", ""], ["null", 3], ["None", 4], ["nan", 5], ["", 6]]
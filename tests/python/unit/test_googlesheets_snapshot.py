@@ -0,0 +1,43 @@
+from googlesheets_snapshot import SnapshotStore
+
+
+def get_worksheets_rows():
+    return iter([("Sheet1", iter([["a", 1], []])), ("Sheet2", iter([["b"]]))])
+
+
+def read_all(worksheets_rows):
+    return [(worksheet_title, list(rows)) for worksheet_title, rows in worksheets_rows]
+
+
+def test_snapshot_recorded_and_read(tmp_path):
+    snapshots = SnapshotStore(str(tmp_path))
+    assert snapshots.get_meta("key", "12") is None
+    assert read_all(snapshots.record("key", "12", get_worksheets_rows())) == [("Sheet1", [["a", 1], []]), ("Sheet2", [["b"]])]
+    assert snapshots.get_meta("key", "12") == {"version": "12", "sheets": {"Sheet1": {"rows": 2}, "Sheet2": {"rows": 1}}}
+    assert read_all(snapshots.iter_worksheets_rows("key")) == [("Sheet1", [["a", 1], []]), ("Sheet2", [["b"]])]
+
+
+def test_snapshot_of_other_version(tmp_path):
+    snapshots = SnapshotStore(str(tmp_path))
+    read_all(snapshots.record("key", "12", get_worksheets_rows()))
+    assert snapshots.get_meta("key", "13") is None
+    assert snapshots.get_meta("key", None) is None
+    assert snapshots.get_meta("other key", "12") is None
+
+
+def test_snapshot_without_version(tmp_path):
+    snapshots = SnapshotStore(str(tmp_path))
+    assert read_all(snapshots.record("key", None, get_worksheets_rows())) == [("Sheet1", [["a", 1], []]), ("Sheet2", [["b"]])]
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_snapshot_of_partial_read(tmp_path):
+    # Rows left over by a sheet are recorded, but an interrupted read is not kept
+    snapshots = SnapshotStore(str(tmp_path))
+    worksheets_rows = snapshots.record("key", "12", get_worksheets_rows())
+    next(worksheets_rows)
+    worksheet_title, rows = next(worksheets_rows)
+    assert worksheet_title == "Sheet2"
+    worksheets_rows.close()
+    assert snapshots.get_meta("key", "12") is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,99 @@
+from googlesheets_upsert import normalize_cell, get_deletion_ranges, get_update_ranges, WorksheetUpsertWriter
+
+
+class FakeWorksheet(object):
+    title = "Sheet1"
+
+
+class FakeSession(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def iter_worksheet_rows(self, worksheet, value_render_option="FORMATTED_VALUE"):
+        return iter(self.rows)
+
+
+def get_changes(sheet_rows, written_rows, columns=("id", "value"), keys=("id",)):
+    writer = WorksheetUpsertWriter(FakeSession(sheet_rows), FakeWorksheet(), list(columns), list(keys))
+    writer.write_rows(written_rows)
+    return writer.get_changes()
+
+
+def test_normalize_cell_large_integers():
+    assert normalize_cell(12345678901) != normalize_cell(12345678902)
+    assert normalize_cell(12345678901) == normalize_cell("12345678901")
+    assert normalize_cell(2 ** 60) != normalize_cell(2 ** 60 + 1)
+
+
+def test_normalize_cell_floats():
+    assert normalize_cell(12.0) == normalize_cell(12) == normalize_cell("12")
+    assert normalize_cell(0.1) == normalize_cell("0.1")
+    assert normalize_cell(1.00000000001) != normalize_cell(1.00000000002)
+    assert normalize_cell("1e3") == normalize_cell(1000)
+
+
+def test_normalize_cell_strings():
+    assert normalize_cell(None) == ""
+    assert normalize_cell(True) == "TRUE"
+    assert normalize_cell("true") == "TRUE"
+    assert normalize_cell("true", "RAW") == "true"
+    assert normalize_cell("12", "RAW") == "12"
+    assert normalize_cell("nan") == "nan"
+    assert normalize_cell("1.2.3") == "1.2.3"
+
+
+def test_normalize_cell_dates():
+    # 2020-01-01 10:00:00, as computed by Google with a different rounding
+    serial_number = 43831 + 10 / 24.0 + 1e-11
+    assert normalize_cell(serial_number, is_date=True) == normalize_cell("2020-01-01 10:00:00", is_date=True)
+    assert normalize_cell(serial_number, is_date=True) != normalize_cell("2020-01-01 10:00:01", is_date=True)
+    # Outside of date columns, numbers are compared exactly
+    assert normalize_cell(serial_number) != normalize_cell(43831 + 10 / 24.0)
+    assert normalize_cell("2020-01-01 10:00:00") == "2020-01-01 10:00:00"
+
+
+def test_get_deletion_ranges():
+    assert get_deletion_ranges([]) == []
+    assert get_deletion_ranges([7, 2, 3, 4, 9, 10]) == [(9, 10), (7, 7), (2, 4)]
+
+
+def test_get_update_ranges():
+    assert get_update_ranges({}) == []
+    assert get_update_ranges({5: ["e"], 2: ["b"], 3: ["c"]}) == [(2, [["b"], ["c"]]), (5, [["e"]])]
+
+
+def test_changes_with_large_integer_keys():
+    sheet_rows = [["id", "value"], [12345678901, "a"], [12345678902, "b"]]
+    updated_rows, appended_rows, deleted_rows_numbers = get_changes(sheet_rows, [[12345678901, "a"], [12345678902, "b"]])
+    assert (updated_rows, appended_rows, deleted_rows_numbers) == ({}, [], [])
+
+
+def test_changes_beyond_ten_digits():
+    sheet_rows = [["id", "value"], [1, 12345678901]]
+    updated_rows, appended_rows, deleted_rows_numbers = get_changes(sheet_rows, [[1, 12345678902]])
+    assert updated_rows == {2: [1, 12345678902]}
+    assert (appended_rows, deleted_rows_numbers) == ([], [])
+
+
+def test_changes():
+    sheet_rows = [["id", "value"], [1, "a"], [2, "b"], [3, "c"], [2, "duplicate"], [4, "d"]]
+    written_rows = [[1, "a"], [2, "changed"], [4, "d"], [5, "new"]]
+    updated_rows, appended_rows, deleted_rows_numbers = get_changes(sheet_rows, written_rows)
+    assert updated_rows == {3: [2, "changed"]}
+    assert appended_rows == [[5, "new"]]
+    assert sorted(deleted_rows_numbers) == [4, 5]
+
+
+def test_changes_with_dates():
+    sheet_rows = [["id", "date"], [1, 43831 + 10 / 24.0 + 1e-11], [2, 43831.0]]
+    written_rows = [[1, "2020-01-01 10:00:00"], [2, "2020-01-02 00:00:00"]]
+    updated_rows, appended_rows, deleted_rows_numbers = get_changes(sheet_rows, written_rows, columns=("id", "date"))
+    assert updated_rows == {3: [2, "2020-01-02 00:00:00"]}
+
+
+def test_changes_with_different_header():
+    sheet_rows = [["other"], ["x"], ["y"]]
+    updated_rows, appended_rows, deleted_rows_numbers = get_changes(sheet_rows, [[1, "a"]])
+    assert updated_rows == {1: ["id", "value"]}
+    assert appended_rows == [[1, "a"]]
+    assert deleted_rows_numbers == [2, 3]
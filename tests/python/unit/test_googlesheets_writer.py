@@ -0,0 +1,127 @@
+import threading
+import time
+import googlesheets_client
+from googlesheets_client import GoogleSheetsClient
+from googlesheets_common import DSSConstants
+from googlesheets_writer import WorksheetRangesWriter, BatchSizer
+
+
+class FakeSpreadsheet(object):
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self.updated_ranges = []
+
+    def values_update(self, a1_range, params=None, body=None):
+        if self.on_update:
+            self.on_update(a1_range)
+        self.updated_ranges.append(a1_range)
+
+
+class FakeResponse(object):
+    ok = True
+    content = b"{}"
+
+    def __init__(self, body):
+        self.request = FakeResponse.Request(body)
+
+    class Request(object):
+        def __init__(self, body):
+            self.body = body
+
+    def json(self):
+        return {}
+
+
+class FakeHttpSession(object):
+    def put(self, endpoint, json=None, **kwargs):
+        time.sleep(0.01)
+        return FakeResponse(b"x" * len("{}".format(json)))
+
+
+class ClientSpreadsheet(object):
+    # Sends the writes through a GoogleSheetsClient, with its rate limiter
+    id = "document"
+
+    def __init__(self, client):
+        self.client = client
+
+    def values_update(self, a1_range, params=None, body=None):
+        url = googlesheets_client.SPREADSHEETS_API_V4_BASE_URL + "/{}/values/{}".format(self.id, a1_range)
+        return self.client.request("put", url, params=params, json=body).json()
+
+
+class FakeWorksheet(object):
+    title = "Sheet1"
+
+    def __init__(self, row_count=1000, col_count=26, on_update=None):
+        self.row_count = row_count
+        self.col_count = col_count
+        self.spreadsheet = FakeSpreadsheet(on_update)
+        self.resizes = []
+
+    def resize(self, rows=None, cols=None):
+        assert rows * cols <= DSSConstants.MAX_CELLS_PER_DOCUMENT
+        self.resizes.append((rows, cols))
+
+
+def test_grid_narrowed_to_written_columns():
+    worksheet = FakeWorksheet()
+    writer = WorksheetRangesWriter(worksheet, "RAW", number_of_workers=1, truncate=True)
+    for _ in range(20):
+        writer.write_rows([["a"] * 5] * 20000)
+    writer.close()
+    assert worksheet.resizes[0] == (20000, 5)
+    assert worksheet.resizes[-1] == (400000, 5)
+
+
+def test_grid_growth_capped():
+    worksheet = FakeWorksheet(col_count=20)
+    writer = WorksheetRangesWriter(worksheet, "RAW", number_of_workers=1)
+    for _ in range(9):
+        writer.write_rows([["a"] * 20] * 50000)
+    assert writer.grid_rows == DSSConstants.MAX_CELLS_PER_DOCUMENT // 20
+    writer.close()
+    assert worksheet.resizes[-1] == (450000, 20)
+
+
+def test_commits_wait_for_earlier_batches():
+    first_batch_released = threading.Event()
+    last_batch_written = threading.Event()
+    commits = []
+
+    def on_update(a1_range):
+        # The first batch is only written once the last one is
+        if a1_range == "'Sheet1'!A1:B10":
+            assert first_batch_released.wait(5)
+        elif a1_range == "'Sheet1'!A21:B30":
+            last_batch_written.set()
+
+    def on_commit(committed_row):
+        commits.append((committed_row, list(worksheet.spreadsheet.updated_ranges)))
+
+    worksheet = FakeWorksheet(on_update=on_update)
+    writer = WorksheetRangesWriter(worksheet, "RAW", number_of_workers=3, on_commit=on_commit)
+    for _ in range(3):
+        writer.write_rows([["a", "b"]] * 10)
+    assert last_batch_written.wait(5)
+    assert commits == []
+    first_batch_released.set()
+    writer.close()
+    assert [committed_row for committed_row, _ in commits] == [30]
+    assert len(commits[0][1]) == 3
+
+
+def test_throttling_does_not_shrink_batches(monkeypatch):
+    # Every request waits longer than a slow write for the quota
+    monkeypatch.setattr(DSSConstants, "FAST_WRITE_LATENCY", 0.1)
+    monkeypatch.setattr(DSSConstants, "SLOW_WRITE_LATENCY", 0.15)
+    monkeypatch.setattr(googlesheets_client.TokenBucket, "acquire", lambda token_bucket: time.sleep(0.2))
+    worksheet = FakeWorksheet(row_count=100000, col_count=2)
+    worksheet.spreadsheet = ClientSpreadsheet(GoogleSheetsClient(None, session=FakeHttpSession()))
+    batch_sizer = BatchSizer(10)
+    assert batch_sizer.is_full(10, DSSConstants.MIN_BYTES_PER_WRITE_REQUEST, 20)
+    writer = WorksheetRangesWriter(worksheet, "RAW", number_of_workers=2, batch_sizer=batch_sizer)
+    for _ in range(4):
+        writer.write_rows([["a", "b"]] * 10)
+    writer.close()
+    assert batch_sizer.target_bytes == 16 * DSSConstants.MIN_BYTES_PER_WRITE_REQUEST